@@ -1,89 +1,178 @@
-import pickle
 import math
-
-from instance import Instance
-from parse import parse
-from d_tree import d_tree
+import os
+import random
+from array import array
+
+import model_file
+from instrument import Stage
+from metrics import evaluate, score
+from parse import Corpora, SHARD_SIZE
+from d_tree import matrix_tree
+from compiled_tree import compile_tree, decompile
+from corpus_index import goal_groups, split_groups
+from feature_matrix import Codebook, extract
+from score_table import fold
 from weighted_sample import WeightedSample
 
+# smallest error, as a share of the distribution, a stump is credited with
+MIN_ERROR = 1e-10
+
 
 class AdaModel:
     """
     This class represents a model based on
     adaboost.
     """
+    compiled = None
+    weights = None
+    table = None
+    source = None
+    keep_weights = False
+
     def __init__(self, train_file="./in/train.dat", test_file="./in/test.dat",
-                 out_file="./out/ensemble.oj"):
+                 out_file="./out/ensemble.oj", workers=1, shard_size=SHARD_SIZE, store=None, ngrams=None,
+                 keep_weights=False):
         """
         Initialize the model.
 
         :param train_file: training data
         :param test_file: test data
         :param out_file: output data
+        :param workers: feature extraction processes
+        :param shard_size: bytes per extraction task
+        :param store: feature store to reuse features from
+        :param ngrams: NgramHasher adding n-gram features, or None
+        :param keep_weights: save the sample weights with the model,
+                             so training can be resumed?
         """
-        files = (train_file, test_file)
-        lines = parse(files)
-
-        self.data = {"train": lines[0], "test": lines[1]}
+        self.data = Corpora(train_file, test_file, ngrams, workers, shard_size, store)
         self.out_file = out_file
         self.ensemble = []
+        self.compiled = None
         self.tree = None
+        self.weights = None
+        self.table = None
+        self.keep_weights = keep_weights
 
-    def train(self, ensemble_size=5):
+    def train(self, ensemble_size=5, warm_start=False, holdout=0, patience=3, sample_size=0, seed=0, save=True):
         """
         Learns an ensemble using adaboost and
         saves the model to a file.
-        """
 
+        :param ensemble_size: number of stumps to add
+        :param warm_start: add to the current ensemble,
+                           starting from its sample weights?
+        :param holdout: share of the training rows held out
+                        to stop early on, 0 for none
+        :param patience: rounds without a better held-out
+                         accuracy before stopping
+        :param sample_size: if set, every stump is learned from
+                            this many rows drawn by weight,
+                            instead of from every weighted row
+        :param seed: random seed of the draws
+        :param save: save the model to its out_file?
+        """
         examples = self.data["train"]
-        features = set(examples[0].features.keys())
-        sample = WeightedSample(examples)
-        self.ensemble = []
+        features = examples.codebook.features()
+        held = holdout_rows(examples, holdout, seed)
+        rows = [i for i in range(examples.size()) if i not in held] if held else list(range(examples.size()))
 
-        for i in range(ensemble_size):
-            stump = d_tree(examples, features, [], 1)
-            error = 0
+        self.table = None
 
-            for ex in examples:
-                decision = stump.decide(ex)
+        if not warm_start or self.weights is None:
+            self.ensemble = []
+            self.compiled = []
+            self.weights = None
 
-                if decision != ex.goal:
-                    error += ex.weight
+        sample = WeightedSample(examples, self.weights)
 
-            for j in range(len(examples)):
-                ex = examples[j]
-                decision = stump.decide(ex)
+        for i in held:
+            sample.change_weight(i, 0.0)
 
-                if decision == ex.goal:
-                    new_weight = ex.weight * error/(sample.dist_sum - error)
-                    sample.change_weight(j, new_weight)
+        stopper = EarlyStopping(self, held, patience) if held else None
+        rng = random.Random(seed)
 
-            sample.normalize()
-            stump.weight = math.log(sample.dist_sum - error)/error
-            self.ensemble.append(stump)
+        for i in range(ensemble_size):
+            with Stage("ada_round"):
+                if sample_size:
+                    stump = resampled_stump(examples, sample.draw(sample_size, rng), features)
+                else:
+                    stump = matrix_tree(examples, rows, features, [], 1)
+
+                compiled = compile_tree(stump, examples.codebook)
+                correct = [code == goal for code, goal in zip(compiled.predict(examples), examples.goals)]
+                error = sample.error(correct)
+                perfect = error == 0
+                error = max(error, MIN_ERROR * sample.dist_sum)
+
+                sample.reweight(correct, error/(sample.dist_sum - error))
+                sample.normalize()
+                stump.weight = compiled.weight = math.log(sample.dist_sum - error)/error
+                self.ensemble.append(stump)
+                self.compiled.append(compiled)
+                self.weights = examples.weights
+
+            stop = stopper.stop() if stopper else False
+
+            # a stump without errors outvotes every other
+            # and leaves the distribution as it was
+            if perfect or stop:
+                break
+
+        if stopper:
+            stopper.restore()
+            release(self.weights, held)
+
+        if save:
+            self.save()
+
+    def resume(self, model):
+        """
+        Takes over the stumps and sample weights
+        of a saved model, so that training with
+        warm_start adds stumps to them. The saved
+        weights must come from this model's
+        training data. A loaded model's weights are
+        only read from its file here.
+
+        :param model: a loaded AdaModel
+        """
+        examples = self.data["train"]
+        weights = model.weights
+
+        if weights is None and model.source and model_file.is_model_file(model.source):
+            weights = model_file.read_weights(model.source)
+
+        if weights is None:
+            raise ValueError("the model has no saved sample weights; train it with --keep-weights")
+        if len(weights) != examples.size():
+            raise ValueError("the model's sample weights are for " + str(len(weights)) +
+                             " rows, the training data has " + str(examples.size()))
 
-        f = open(self.out_file, "wb")
-        pickle.dump(self, f)
-        f.close()
+        self.ensemble = model.ensemble if model.ensemble else [decompile(stump) for stump in model.compile()]
+        self.compiled = [compile_tree(stump, examples.codebook) for stump in self.ensemble]
+        self.weights = array("d", weights)
+        self.table = None
 
-    def test(self, test_file=None):
+    def test(self, test_file=None, workers=1, shard_size=SHARD_SIZE, rows=None, mistakes=10, report=None):
         """
-        Tests the model.
+        Tests the model, printing the precision and
+        recall of every classification, a sample of
+        misclassified lines and the accuracy.
 
         :param test_file: test data
+        :param workers: feature extraction processes
+        :param shard_size: bytes per extraction task
+        :param rows: line numbers of the test data to test on,
+                     read through its line index; None for all
+        :param mistakes: misclassified lines to print
+        :param report: file to write the metrics to as JSON, or None
+        :return: the metrics
         """
-        if not self.ensemble:
+        if not self.ensemble and not self.compiled:
             self.train()
 
-        examples = parse([test_file])[0] if test_file else self.data["test"]
-        result = []
-
-        for ex in examples:
-            d = self.vote(ex)
-
-            result.append({"value": ex.value, "result": d, "goal": ex.goal})
-
-        evaluate(result, examples)
+        return evaluate(self, test_file, workers, shard_size, rows, mistakes, report)
 
     def predict(self, line):
         """
@@ -92,62 +181,264 @@ class AdaModel:
         :param line: line to test
         :return: prediction (en or nl)
         """
-        if not self.ensemble:
+        if not self.ensemble and not self.compiled:
             self.train()
 
-        ex = Instance(line, preserve=True)
-        d = self.vote(ex)
-        print("| value:", ex.value, "| result:", d)
+        d = self.predict_block(extract([line], self.codebook(), preserve=True))[0]
+        print("| value:", line, "| result:", d)
         return d
 
     def vote(self, instance):
         """
         Classifies an instance by collecting
-        votes from the ensemble
+        votes from the ensemble, through its
+        score table
 
         :param instance: instance to classify
         :return: classification
         """
-        count = {}
-        max_count = 0
-        winner = None
+        return self.scores().decide(instance)
 
-        for stump in self.ensemble:
-            decision = stump.decide(instance)
+    def predict_block(self, matrix):
+        """
+        Classifies every row of a feature matrix
+        with the ensemble's score table
 
-            if decision in count:
-                count[decision] += stump.weight
-            else:
-                count[decision] = stump.weight
+        :param matrix: feature matrix
+        :return: list of classifications
+        """
+        label = self.compile()[0].label
 
-            if count[decision] > max_count:
-                max_count = count[decision]
-                winner = decision
+        return [label(code) for code in self.scores().predict(matrix)]
 
-        return winner
+    def scores(self):
+        """
+        Folds the compiled stumps into one
+        additive score table.
 
+        :return: the score table
+        """
+        if not self.table:
+            self.table = fold(self.compile())
 
-def evaluate(results, examples):
+        return self.table
+
+    def compile(self):
+        """
+        Flattens the stumps for fast prediction.
+        The compiled stumps share one codebook.
+
+        :return: list of compiled stumps
+        """
+        if not self.compiled:
+            codebook = Codebook()
+            self.compiled = [compile_tree(stump, codebook) for stump in self.ensemble]
+
+        return self.compiled
+
+    def codebook(self):
+        """
+        :return: codebook of the compiled stumps
+        """
+        return self.compile()[0].codebook
+
+    def score(self, matrix):
+        """
+        :param matrix: feature matrix of labeled rows
+        :return: accuracy on the rows, or None if there are none
+        """
+        return score(self, matrix)
+
+    def save(self, out_file=None):
+        """
+        Saves the compiled stumps to a model file,
+        with their accuracy on the test data when
+        the model has test data, and with the sample
+        weights when keep_weights is set. A model loaded
+        from the same file first copies its mapped arrays.
+
+        :param out_file: output file, defaults to
+                         the model's out_file
+        """
+        path = out_file if out_file else self.out_file
+        test = self.data.get("test") if isinstance(self.data, Corpora) else None
+        accuracy = self.score(test) if test is not None else None
+
+        if self.source and os.path.abspath(path) == os.path.abspath(self.source):
+            for stump in self.compile():
+                stump.detach()
+
+        model_file.write(path, "ada", self.compile(), self.weights if self.keep_weights else None, accuracy)
+
+
+def resampled_stump(matrix, rows, features):
     """
-    Evaluates results from a model.
+    Learns a stump from rows drawn by weight.
+    The draw already follows the distribution,
+    so the rows count once per draw, unweighted.
+
+    :param matrix: feature matrix
+    :param rows: drawn row indices, with repeats
+    :param features: set of feature names
+    :return: the stump
+    """
+    weights = matrix.weights
+    matrix.weights = None
+
+    try:
+        return matrix_tree(matrix, rows, features, [], 1)
+    finally:
+        matrix.weights = weights
 
-    :param results: list of results
-    :param examples: test data
+
+class EarlyStopping:
+    """
+    This class tracks the accuracy of a growing
+    ensemble on held-out rows of its training
+    data, and remembers the best ensemble. The
+    held-out rows keep a running score per
+    classification, so each round only adds the
+    newest stump's votes on those rows.
     """
-    correct = 0
 
-    print()
+    def __init__(self, model, rows, patience):
+        """
+        Initialize with the current ensemble as
+        the best so far.
+
+        :param model: the AdaModel being trained
+        :param rows: held-out row indices
+        :param patience: rounds without improvement allowed
+        """
+        examples = model.data["train"]
+        self.model = model
+        self.held = examples.take(sorted(rows))
+        self.slots = len(examples.codebook.classes) + 1
+        self.scores = [[0.0] * self.held.size() for _ in range(self.slots)]
+        self.seen = 0
+        self.patience = patience
+        self.best = self.accuracy()
+        self.best_size = len(model.compiled)
+        self.best_weights = array("d", model.weights) if model.weights is not None else None
+        self.waited = 0
+
+    def accuracy(self):
+        """
+        :return: accuracy of the ensemble on the held-out rows
+        """
+        compiled = self.model.compiled
+
+        if not compiled:
+            return -1
+
+        for stump in compiled[self.seen:]:
+            for i, code in enumerate(stump.predict(self.held)):
+                self.scores[self.slots - 1 if code < 0 else code][i] += stump.weight
+
+        self.seen = len(compiled)
+        correct = 0
 
-    for res in results:
-        if res["result"] == res["goal"]:
-            correct += 1
+        for i, goal in enumerate(self.held.goals):
+            best = 0
+
+            for slot in range(1, self.slots):
+                if self.scores[slot][i] > self.scores[best][i]:
+                    best = slot
+
+            if best == goal:
+                correct += 1
+
+        return correct / self.held.size()
+
+    def stop(self):
+        """
+        Scores the latest round.
+
+        :return: True if boosting should stop
+        """
+        accuracy = self.accuracy()
+
+        if accuracy > self.best:
+            self.best = accuracy
+            self.best_size = len(self.model.compiled)
+            self.best_weights = array("d", self.model.weights)
+            self.waited = 0
         else:
-            print("| oops!")
+            self.waited += 1
+
+        return self.waited >= self.patience
+
+    def restore(self):
+        """
+        Drops the rounds after the best one.
+        """
+        model = self.model
+        del model.ensemble[self.best_size:]
+        del model.compiled[self.best_size:]
+        model.weights = self.best_weights
+
+
+def holdout_rows(matrix, share, seed=0):
+    """
+    Draws a random subset of the rows to hold
+    out, keeping the share of every label.
+
+    :param matrix: feature matrix of labeled rows
+    :param share: share of the rows to hold out
+    :param seed: random seed
+    :return: set of row indices
+    """
+    if share <= 0:
+        return set()
+
+    return set(split_groups(goal_groups(matrix), share, seed)[1])
+
+
+def release(weights, held):
+    """
+    Gives the held-out rows, weighted 0 while
+    training, the mean weight of the other rows
+    and renormalizes, so saved weights resume
+    with every row in the distribution.
+
+    :param weights: weight of every row, changed in place
+    :param held: set of held-out row indices
+    """
+    n = len(weights)
+
+    if not held or len(held) >= n:
+        return
+
+    mean = sum(weights) / (n - len(held))
 
-        print("| value:", res["value"][:50], "| result:", res["result"], "| expected:", res["goal"])
+    for i in held:
+        weights[i] = mean
 
-    print()
-    print(str((correct / len(examples)) * 100) + "%", "accuracy")
+    z = n / sum(weights)
+    weights[:] = array("d", [w * z for w in weights])
+
+
+def from_compiled(compiled, out_file, weights=None):
+    """
+    Builds a model around compiled stumps
+    without reading any data.
+
+    :param compiled: list of compiled stumps
+    :param out_file: output data
+    :param weights: saved sample weights
+    :return: the model
+    """
+    model = AdaModel.__new__(AdaModel)
+    model.data = Corpora()
+    model.out_file = out_file
+    model.ensemble = []
+    model.compiled = compiled
+    model.tree = None
+    model.weights = weights
+    model.table = None
+    model.source = out_file
+
+    return model
 
 
 def main():
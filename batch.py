@@ -0,0 +1,142 @@
+import time
+
+from feature_matrix import FeatureMatrix
+from metrics import Evaluator
+from parse import decode_line, raw_lines, CHUNK_SIZE
+
+
+class BatchStats:
+    """
+    This class collects counts and timings
+    of a batch prediction run.
+    """
+
+    def __init__(self):
+        """
+        Initialize empty stats.
+        """
+        self.lines = 0
+        self.skipped = 0
+        self.metrics = Evaluator(0)
+        self.latencies = []
+        self.cache = None
+        self.start = time.time()
+
+    def add(self, labels, goals, latency):
+        """
+        Records a classified chunk.
+
+        :param labels: predicted classifications
+        :param goals: expected classifications,
+                      None for unlabeled lines
+        :param latency: seconds taken by the chunk
+        """
+        self.lines += len(labels)
+        self.latencies.append(latency)
+
+        for label, goal in zip(labels, goals):
+            if goal is not None:
+                self.metrics.add(None, label, goal)
+
+    def percentile(self, p):
+        """
+        :param p: percentile, 0 to 100
+        :return: chunk latency at that percentile, in ms
+        """
+        if not self.latencies:
+            return 0
+
+        ordered = sorted(self.latencies)
+
+        return ordered[int(round(p / 100 * (len(ordered) - 1)))] * 1000
+
+    def summary(self):
+        """
+        :return: summary line of the run
+        """
+        seconds = time.time() - self.start
+        rate = self.lines / seconds if seconds else 0
+        out = "| lines: " + str(self.lines) + " | skipped: " + str(self.skipped) + \
+              " | lines/sec: " + str(int(rate)) + " | chunk latency ms p50: %.2f p90: %.2f p99: %.2f" % \
+              (self.percentile(50), self.percentile(90), self.percentile(99))
+
+        if self.metrics.total:
+            out += " | accuracy: " + str(self.metrics.accuracy() * 100) + "%"
+
+        if self.cache is not None:
+            out += " | cache hits: " + str(self.cache.hits) + " misses: " + str(self.cache.misses)
+
+        return out
+
+
+def is_labeled(line):
+    """
+    :param line: an input line
+    :return: True if the line looks like <label>|<data>
+    """
+    return line[2:3] == "|"
+
+
+def predict_stream(model, stream, out, chunk_size=CHUNK_SIZE, cache=None):
+    """
+    Classifies lines from a binary stream in
+    chunks, writing one classification per
+    input line as each chunk completes. Lines
+    may be labeled or unlabeled; skipped lines
+    get an empty output line so the output
+    stays aligned with the input.
+
+    :param model: a DecisionModel or AdaModel
+    :param stream: binary input stream
+    :param out: text output stream
+    :param chunk_size: lines per chunk
+    :param cache: feature cache for repeated lines
+    :return: stats of the run
+    """
+    stats = BatchStats()
+    chunk = []
+
+    for raw in raw_lines(stream):
+        chunk.append(raw)
+
+        if len(chunk) == chunk_size:
+            predict_chunk(model, chunk, out, stats, cache)
+            chunk = []
+
+    if chunk:
+        predict_chunk(model, chunk, out, stats, cache)
+
+    stats.cache = cache
+
+    return stats
+
+
+def predict_chunk(model, chunk, out, stats, cache=None):
+    """
+    Classifies one chunk of raw lines and
+    writes the results.
+
+    :param model: a DecisionModel or AdaModel
+    :param chunk: list of raw lines
+    :param out: text output stream
+    :param stats: stats of the run
+    :param cache: feature cache for repeated lines
+    """
+    start = time.time()
+    matrix = FeatureMatrix(model.codebook(), keep_text=False)
+    lines = [decode_line(raw) for raw in chunk]
+
+    for line in lines:
+        if line is None:
+            stats.skipped += 1
+        else:
+            matrix.append(line, not is_labeled(line), cache)
+
+    predicted = model.predict_block(matrix)
+    goals = [matrix.goal(i) for i in range(matrix.size())]
+    labels = iter(predicted)
+
+    out.write("".join("\n" if line is None else (next(labels) or "") + "\n" for line in lines))
+    out.flush()
+
+    stats.add(predicted, goals, time.time() - start)
@@ -0,0 +1,181 @@
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import batch
+import model_file
+from ada_model import AdaModel
+from classify import ints, options
+from d_model import DecisionModel
+from bitset_tree import bitset_tree
+from d_tree import matrix_tree
+from instance import get_features, reference_features
+from loader import load_model
+from parse import parse_matrix, CorpusReader
+
+
+def vocabulary(source):
+    """
+    Collects the words used for each label in
+    a labeled corpus.
+
+    :param source: labeled corpus
+    :return: table of label -> list of words
+    """
+    words = {}
+    reader = CorpusReader([source])
+
+    for line in reader.lines():
+        words.setdefault(line[:2], []).extend(line[3:].split())
+
+    return words
+
+
+def generate(path, size, source="./in/train.dat", seed=0):
+    """
+    Writes a synthetic labeled corpus. Each line
+    draws 10 to 16 words from the vocabulary of
+    one label of the source corpus.
+
+    :param path: output file
+    :param size: number of lines
+    :param source: labeled corpus to draw words from
+    :param seed: random seed
+    """
+    rng = random.Random(seed)
+    words = vocabulary(source)
+    labels = sorted(words)
+
+    with open(path, "w") as f:
+        for i in range(size):
+            label = labels[i % len(labels)]
+            pool = words[label]
+            f.write(label + "|" + " ".join(rng.choice(pool) for _ in range(rng.randint(10, 16))) + "\n")
+
+
+def timed(fn, *args, **kwargs):
+    """
+    :param fn: function to time
+    :return: the function's result and the seconds it took
+    """
+    start = time.time()
+    result = fn(*args, **kwargs)
+
+    return result, time.time() - start
+
+
+def bench_size(size, work_dir, depths, ensembles, sample_size=1000, seed=0):
+    """
+    Runs every benchmark on a corpus of one size.
+
+    :param size: number of lines
+    :param work_dir: directory for corpora and models
+    :param depths: tree depths to build
+    :param ensembles: ensemble sizes to train
+    :param sample_size: rows drawn per round when resampling
+    :param seed: random seed
+    :return: table of results
+    """
+    corpus = os.path.join(work_dir, "corpus-" + str(size) + ".dat")
+    _, seconds = timed(generate, corpus, size, seed=seed)
+    result = {"lines": size, "bytes": os.path.getsize(corpus), "generate_sec": seconds}
+
+    sample = [line for _, line in zip(range(1000), CorpusReader([corpus]).lines())]
+    result["features_match_reference"] = all(get_features(line) == reference_features(line) for line in sample)
+
+    matrix, seconds = timed(parse_matrix, [corpus], keep_text=False)
+    matrix = matrix[0]
+    result["extract"] = {"sec": seconds, "lines_per_sec": size / seconds if seconds else 0}
+
+    rows = list(range(matrix.size()))
+    features = set(matrix.codebook.names)
+    result["tree"] = {}
+
+    for depth in depths:
+        tree, seconds = timed(matrix_tree, matrix, rows, features, [], depth)
+        _, bitset_seconds = timed(bitset_tree, matrix, rows, features, depth)
+        result["tree"][str(depth)] = {"sec": seconds, "bitset_sec": bitset_seconds}
+
+    tree_file = os.path.join(work_dir, "tree-" + str(size) + ".oj")
+    model = DecisionModel(train_file=corpus, test_file=corpus, out_file=tree_file)
+    model.train()
+
+    ada_file = os.path.join(work_dir, "ensemble-" + str(size) + ".oj")
+    model = AdaModel(train_file=corpus, test_file=corpus, out_file=ada_file)
+    model.data["test"]  # parse the corpora before timing training
+    result["ada"] = {}
+
+    for n in ensembles:
+        _, seconds = timed(model.train, n, save=False)
+        result["ada"][str(n)] = {"sec": seconds, "sec_per_stump": seconds / n}
+
+    model.save()
+
+    result["load"] = {}
+    result["predict"] = {}
+
+    for name, path in (("dt", tree_file), ("ada", ada_file)):
+        loaded, seconds = timed(load_model, path)
+        result["load"][name] = {"sec": seconds, "bytes": os.path.getsize(path)}
+
+        with open(corpus, "rb") as f, open(os.devnull, "w") as out:
+            stats, seconds = timed(batch.predict_stream, loaded, f, out)
+
+        result["predict"][name] = {
+            "sec": seconds,
+            "lines_per_sec": stats.lines / seconds if seconds else 0,
+            "accuracy": stats.metrics.accuracy() or 0,
+        }
+
+    test_corpus = os.path.join(work_dir, "test-" + str(size) + ".dat")
+    generate(test_corpus, min(size, 10000), seed=seed + 1)
+    test = parse_matrix([test_corpus], model.data["train"].codebook, keep_text=False)[0]
+    result["ada_resample"] = {"sample_size": sample_size}
+
+    for n in ensembles:
+        result["ada_resample"][str(n)] = {}
+
+        for name, rows in (("full", 0), ("resample", sample_size)):
+            _, seconds = timed(model.train, n, sample_size=rows, seed=seed, save=False)
+            result["ada_resample"][str(n)][name] = {"sec": seconds, "accuracy": model.score(test)}
+
+    return result
+
+
+def main():
+    """
+    Main function. Runs the benchmarks and
+    writes the results as JSON.
+    """
+    _, opts = options(sys.argv)
+    sizes = ints(opts.get("sizes", "10000,100000"))
+    depths = ints(opts.get("depths", "1,3,7"))
+    ensembles = ints(opts.get("ensembles", "5,20"))
+    sample_size = int(opts.get("sample", 1000))
+    out_file = opts.get("out", "bench.json")
+    work_dir = opts.get("dir") or tempfile.mkdtemp()
+    os.makedirs(work_dir, exist_ok=True)
+
+    results = {
+        "python": platform.python_version(),
+        "model_version": model_file.VERSION,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "sizes": {},
+    }
+
+    for size in sizes:
+        print("Benchmarking", size, "lines...", file=sys.stderr)
+        results["sizes"][str(size)] = bench_size(size, work_dir, depths, ensembles, sample_size)
+
+    with open(out_file, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print("Results written to", out_file, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
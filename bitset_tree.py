@@ -0,0 +1,231 @@
+from d_tree import DNode, counts_entropy
+from instrument import profiled, PROFILER
+
+if hasattr(int, "bit_count"):
+    popcount = int.bit_count
+else:
+    def popcount(bits):
+        return bin(bits).count("1")
+
+
+def lowest(bits):
+    """
+    :param bits: a non-empty bitset
+    :return: index of its lowest set bit
+    """
+    return (bits & -bits).bit_length() - 1
+
+
+def to_bitset(rows):
+    """
+    :param rows: row indices
+    :return: bitset of the rows
+    """
+    bitmap = bytearray((max(rows) >> 3) + 1 if rows else 0)
+
+    for i in rows:
+        bitmap[i >> 3] |= 1 << (i & 7)
+
+    return int.from_bytes(bitmap, "little")
+
+
+class BitsetIndex:
+    """
+    This class indexes the rows of a feature
+    matrix by bitsets, held as Python integers:
+    one per value of every feature and one per
+    classification. Bit i is set if row i has
+    the value, or the classification. It is
+    built once; the rows at a tree node are then
+    a bitset too, its children are ANDs and its
+    class counts are popcounts.
+    """
+
+    def __init__(self, matrix):
+        """
+        Build the index.
+
+        :param matrix: feature matrix
+        """
+        codebook = matrix.codebook
+        size = (matrix.size() >> 3) + 1
+        self.matrix = matrix
+        self.names = [name for name in codebook.names if name not in codebook.buckets]
+        self.columns = [codebook.index[name] for name in self.names]
+        self.values = []
+
+        for name, column in zip(self.names, self.columns):
+            bitmaps = [bytearray(size) for _ in codebook.values[column]]
+
+            for i, code in enumerate(matrix.column(name)):
+                bitmaps[code][i >> 3] |= 1 << (i & 7)
+
+            self.values.append([int.from_bytes(bitmap, "little") for bitmap in bitmaps])
+
+        bitmaps = {}
+
+        for i, goal in enumerate(matrix.goals):
+            if goal not in bitmaps:
+                bitmaps[goal] = bytearray(size)
+
+            bitmaps[goal][i >> 3] |= 1 << (i & 7)
+
+        self.classes = [(goal, int.from_bytes(bitmaps[goal], "little")) for goal in sorted(bitmaps)]
+
+    def count_goals(self, bits):
+        """
+        Counts the rows of a bitset for each
+        classification code, in order of the
+        first row of each.
+
+        :param bits: bitset of rows
+        :return: list of (first row, code, count)
+        """
+        count = []
+
+        for goal, class_bits in self.classes:
+            members = bits & class_bits
+
+            if members:
+                count.append((lowest(members), goal, popcount(members)))
+
+        count.sort()
+
+        return count
+
+    def plurality(self, bits):
+        """
+        :param bits: bitset of rows
+        :return: majority classification
+        """
+        code = None
+        max_weight = -1
+
+        for _, goal, weight in self.count_goals(bits):
+            if weight > max_weight:
+                max_weight = weight
+                code = goal
+
+        return None if code is None else self.matrix.codebook.decode_goal(code)
+
+
+@profiled("bitset_tree")
+def bitset_tree(matrix, rows, features, depth=20):
+    """
+    Builds the same decision tree as matrix_tree
+    for an unweighted matrix, partitioning rows
+    with bitsets instead of lists.
+
+    :param matrix: feature matrix
+    :param rows: indices of the training rows
+    :param features: set of feature names
+    :param depth: maximum depth
+
+    :return: The root node of a decision tree
+    """
+    index = BitsetIndex(matrix)
+    mask = 0
+
+    for j, name in enumerate(index.names):
+        if name in features:
+            mask |= 1 << j
+
+    return grow(index, to_bitset(rows), mask, 0, depth)
+
+
+def grow(index, bits, mask, parent_bits, depth):
+    """
+    Builds the subtree of a node.
+
+    :param index: bitset index of the matrix
+    :param bits: bitset of the node's rows
+    :param mask: bitset of the features left, by position in index.names
+    :param parent_bits: bitset of the parent's rows
+    :param depth: maximum depth
+
+    :return: root of the subtree
+    """
+    if PROFILER.enabled:
+        PROFILER.observe("examples_per_node", popcount(bits))
+
+    if not bits:
+        return DNode(index.plurality(parent_bits), is_leaf=True)
+
+    count = index.count_goals(bits)
+
+    if len(count) == 1:
+        return DNode(index.matrix.codebook.decode_goal(count[0][1]), is_leaf=True)
+    if not mask:
+        return DNode(index.plurality(bits), is_leaf=True)
+
+    j, kids = max_gain(index, bits, mask, count)
+    column = index.columns[j]
+    root = DNode(index.names[j])
+
+    if depth < 1:
+        depth = 1
+
+    for code, sub_bits in kids:
+        value = index.matrix.codebook.decode(column, code)
+
+        if depth == 1:
+            subtree = DNode(index.plurality(sub_bits), is_leaf=True)
+        else:
+            subtree = grow(index, sub_bits, mask & ~(1 << j), bits, depth - 1)
+
+        root.add(value, subtree)
+
+    return root
+
+
+@profiled("bitset_max_gain")
+def max_gain(index, bits, mask, count):
+    """
+    Finds the feature whose split of a node's
+    rows leads to the most information gain.
+
+    :param index: bitset index of the matrix
+    :param bits: bitset of the node's rows
+    :param mask: bitset of the features left
+    :param count: class counts of the node, from count_goals
+
+    :return: position of the feature in index.names, and its
+             (code, bitset) children in order of their first row
+    """
+    n = popcount(bits)
+    entrpy = counts_entropy([weight for _, _, weight in count], n)
+    classes = [class_bits for goal, class_bits in index.classes if goal in {c for _, c, _ in count}]
+    max_val = -1
+    max_j = None
+
+    for j in range(len(index.names)):
+        if not mask >> j & 1:
+            continue
+
+        total = 0
+
+        for value_bits in index.values[j]:
+            members = bits & value_bits
+
+            if members:
+                size = popcount(members)
+                counts = [popcount(members & class_bits) for class_bits in classes]
+                total += (size/n) * counts_entropy(counts, size)
+
+        gains = entrpy - total
+
+        if gains > max_val:
+            max_val = gains
+            max_j = j
+
+    kids = []
+
+    for code, value_bits in enumerate(index.values[max_j]):
+        members = bits & value_bits
+
+        if members:
+            kids.append((lowest(members), code, members))
+
+    kids.sort()
+
+    return max_j, [(code, members) for _, code, members in kids]
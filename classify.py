@@ -1,12 +1,26 @@
 import sys
 import pickle
 import os
+import time
 
+import batch
+import corpus_index
+import instrument
+import server
+import sweep
+from loader import load_model, cached_model, convert, discover
+from feature_store import FeatureStore, FeatureCache
+from ngrams import NgramHasher
 from d_model import DecisionModel
 from ada_model import AdaModel
+from parse import SHARD_SIZE, CHUNK_SIZE, CorpusReader
 
+# options that take no value
+FLAGS = ("keep-weights",)
 
-def train(examples, out_file, learner):
+
+def train(examples, out_file, learner, workers=1, shard_size=SHARD_SIZE, cache_dir=None,
+          rounds=5, resume=None, holdout=0, patience=3, ngrams=None, sample_size=0, keep_weights=False):
     """
     Train a learner on some examples and saves
     the resulting model to a file.
@@ -14,18 +28,44 @@ def train(examples, out_file, learner):
     :param examples: training data
     :param out_file: output file
     :param learner: "ada" or "dt"
+    :param workers: feature extraction processes
+    :param shard_size: bytes per extraction task
+    :param cache_dir: directory of a feature store
+    :param rounds: stumps to add to an ada ensemble
+    :param resume: ada model to add stumps to
+    :param holdout: share of the examples held out to stop ada training early
+    :param patience: ada rounds without improvement before stopping
+    :param ngrams: NgramHasher adding n-gram features, or None
+    :param sample_size: rows drawn by weight per ada round, 0 for all rows
+    :param keep_weights: save an ada model's sample weights, so it can be resumed
 
     :return:
     """
+    start = time.time()
+    store = FeatureStore(cache_dir) if cache_dir else None
+
+    if learner == "dt":
+        model = DecisionModel(train_file=examples, out_file=out_file, workers=workers, shard_size=shard_size,
+                              store=store, ngrams=ngrams)
+    else:
+        model = AdaModel(train_file=examples, out_file=out_file, workers=workers, shard_size=shard_size,
+                         store=store, ngrams=ngrams, keep_weights=keep_weights)
+
+    lines = model.data["train"].size() + model.data["test"].size()
+    seconds = time.time() - start
+    print("| lines:", lines, "| lines/sec:", int(lines / seconds) if seconds else 0)
+
     if learner == "dt":
-        model = DecisionModel(train_file=examples, out_file=out_file)
+        model.train()
     else:
-        model = AdaModel(train_file=examples, out_file=out_file)
+        if resume:
+            model.resume(load_model(resume))
 
-    model.train()
+        model.train(rounds, warm_start=bool(resume), holdout=holdout, patience=patience, sample_size=sample_size)
+        print("| stumps:", len(model.compiled))
 
 
-def predict(h_file, test_file):
+def predict(h_file, test_file, workers=1, shard_size=SHARD_SIZE, subset=0, seed=0, mistakes=10, report=None):
     """
     Loads a hypothesis (model) from h_file and
     uses it to predict the results of instances
@@ -33,41 +73,261 @@ def predict(h_file, test_file):
 
     :param h_file: model file
     :param test_file: test file
+    :param workers: feature extraction processes
+    :param shard_size: bytes per extraction task
+    :param subset: if set, test on this many lines drawn at
+                   random, keeping the share of every label
+    :param seed: random seed of the subset
+    :param mistakes: misclassified lines to print
+    :param report: file to write the metrics to as JSON, or None
+    """
+    model = load_model(h_file)
+    rows = corpus_index.load(test_file).stratified(subset, seed) if subset else None
+    model.test(test_file, workers, shard_size, rows, mistakes, report)
+
+
+def tune(examples, folds=5, depths=(), rounds=(), workers=1, seed=0, ngrams=None, report=None):
+    """
+    Cross-validates decision trees of several
+    depths and ensembles of several sizes on
+    some examples, and prints their accuracy,
+    training time and size.
+
+    :param examples: training data
+    :param folds: number of folds
+    :param depths: decision tree depths
+    :param rounds: AdaBoost ensemble sizes
+    :param workers: worker processes
+    :param seed: random seed of the folds
+    :param ngrams: NgramHasher adding n-gram features, or None
+    :param report: file to write the results to as JSON, or None
+    """
+    start = time.time()
+    results = sweep.cross_validate(examples, sweep.configurations(depths, rounds), folds, workers, seed, ngrams)
+
+    sweep.report(results)
+    print("| folds:", folds, "| workers:", workers, "| seconds:", round(time.time() - start, 2))
+
+    if report:
+        sweep.write(results, report)
+
+
+def models(directory="out"):
+    """
+    Lists the model files in a directory, read
+    from their headers.
+
+    :param directory: directory to search
+    """
+    for m in discover(directory):
+        print("|", m["path"], "|", m["kind"], "| trees:", m["trees"], "| nodes:", m["nodes"],
+              "| bytes:", m["bytes"], "| accuracy:", m["accuracy"])
+
+
+def index(corpus):
+    """
+    Builds the line index of a corpus and
+    prints its number of lines per label.
+
+    :param corpus: corpus file
+    """
+    line_index = corpus_index.build(corpus)
+
+    for label, rows in sorted(line_index.by_label().items()):
+        print("|", label + ":", len(rows))
+
+    print("| lines:", line_index.size(), "| index:", corpus_index.index_path(corpus))
+
+
+def predict_batch(h_file, test_file, chunk_size=CHUNK_SIZE, cache_size=0, report=None):
+    """
+    Loads a hypothesis (model) from h_file and
+    streams the lines of a file, or stdin, through
+    it in chunks. One classification per line is
+    written to stdout and a summary to stderr.
+
+    :param h_file: model file
+    :param test_file: input file, or "-" for stdin
+    :param chunk_size: lines per chunk
+    :param cache_size: lines kept in the feature cache, 0 for none
+    :param report: file to write the metrics of labeled lines to as JSON, or None
+    """
+    model = load_model(h_file)
+    cache = FeatureCache(cache_size) if cache_size else None
+
+    if test_file == "-":
+        stats = batch.predict_stream(model, sys.stdin.buffer, sys.stdout, chunk_size, cache)
+    else:
+        with open(test_file, "rb") as f:
+            stats = batch.predict_stream(model, f, sys.stdout, chunk_size, cache)
+
+    print(stats.summary(), file=sys.stderr)
+
+    if report:
+        stats.metrics.write(report)
+
+
+def update(h_file, examples, out_file=None, grace=200):
+    """
+    Loads a decision tree model from h_file, grows
+    it with the labeled lines of a file and saves
+    it, without retraining on the original data.
+
+    :param h_file: model file
+    :param examples: new labeled examples
+    :param out_file: output file, defaults to h_file
+    :param grace: examples a leaf sees between split attempts
+    """
+    model = load_model(h_file)
+
+    if not isinstance(model, DecisionModel):
+        print("Only decision tree (dt) models can be updated.")
+        exit(1)
+
+    model.learner().grace = grace
+    reader = CorpusReader([examples])
+
+    for block in reader.blocks(model.codebook(), keep_text=False):
+        model.update_block(block)
+
+    print(model.learner().report(), reader.report())
+    model.save(out_file if out_file else h_file)
+
+
+def serve(h_file, port=8000, socket_path=None, cache_size=100000):
+    """
+    Loads a hypothesis (model) from h_file once
+    and serves predictions over HTTP until
+    interrupted.
+
+    :param h_file: model file
+    :param port: localhost port to listen on
+    :param socket_path: Unix socket to listen on
+                        instead of a port
+    :param cache_size: lines kept in the feature cache, 0 for none
+    """
+    httpd = server.make_server(load_model(h_file), port, socket_path, cache_size=cache_size)
+    print("Serving on", socket_path if socket_path else "http://127.0.0.1:" + str(port))
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+def options(args, flags=()):
+    """
+    Separates "--name value" options, and
+    "--name" flags, from positional arguments.
+
+    :param args: command line arguments
+    :param flags: names of options that take no value
+    :return: positional arguments and table of options,
+             with True for every flag given
     """
-    h_file = open(h_file, "rb")
-    model = pickle.load(h_file)
+    positional = []
+    opts = {}
+    i = 0
 
-    h_file.close()
-    model.test(test_file)
+    while i < len(args):
+        if args[i].startswith("--") and args[i][2:] in flags:
+            opts[args[i][2:]] = True
+            i += 1
+        elif args[i].startswith("--") and i + 1 < len(args):
+            opts[args[i][2:]] = args[i + 1]
+            i += 2
+        else:
+            positional.append(args[i])
+            i += 1
+
+    return positional, opts
+
+
+def ints(text):
+    """
+    :param text: comma separated integers
+    :return: list of integers
+    """
+    return [int(x) for x in text.split(",") if x]
 
 
-def usage(train_msg=True, predict_msg=True):
-    if train_msg:
-        print("Usage: python3 classify.py train <examples> <hypothesisOut> <learning-type>")
+def ngram_hasher(opts):
+    """
+    :param opts: table of options
+    :return: NgramHasher of the --ngrams and
+             --ngram-sizes options, or None
+    """
+    if not opts.get("ngrams"):
+        return None
+
+    return NgramHasher(int(opts["ngrams"]), ints(opts.get("ngram-sizes", "1,2,3")))
 
-    if predict_msg:
-        print("Usage: python3 classify.py predict <hypothesis> <file>")
+
+# usage lines of every command
+USAGE = {
+    "train": ("Usage: python3 classify.py train <examples> <hypothesisOut> <learning-type>"
+              " [--workers <n>] [--chunk-size <bytes>] [--cache <dir>]",
+              "       [--ngrams <buckets>] [--ngram-sizes <n,n,...>]",
+              "       ada only: [--rounds <n>] [--resume <hypothesis>] [--holdout <share>] [--patience <n>]"
+              " [--sample <n>] [--keep-weights]"),
+    "predict": ("Usage: python3 classify.py predict <hypothesis> <file> [--workers <n>] [--chunk-size <bytes>]"
+                " [--subset <n>] [--seed <n>]",
+                "       [--mistakes <n>] [--report <file>]",
+                "Usage: python3 classify.py predict <hypothesis> <file|-> --mode batch [--chunk-lines <n>]"
+                " [--cache-lines <n>] [--report <file>]"),
+    "update": ("Usage: python3 classify.py update <hypothesis> <examples> [hypothesisOut] [--grace <n>]",),
+    "sweep": ("Usage: python3 classify.py sweep <examples> [--folds <n>] [--depths <n,n,...>] [--rounds <n,n,...>]"
+              " [--workers <n>] [--seed <n>] [--report <file>]",),
+    "index": ("Usage: python3 classify.py index <file>",),
+    "models": ("Usage: python3 classify.py models [directory]",),
+    "convert": ("Usage: python3 classify.py convert <hypothesis> <hypothesisOut>",),
+    "serve": ("Usage: python3 classify.py serve <hypothesis> [--port <n>] [--socket <path>] [--cache-lines <n>]",),
+}
+
+
+def usage(command=None):
+    """
+    Prints how to use a command, or every
+    command, and exits.
+
+    :param command: the command, or None for all
+    """
+    print("Every command accepts --profile <file> to write stage timings, counters and memory use as JSON.")
+
+    for name, lines in USAGE.items():
+        if command is None or name == command:
+            for line in lines:
+                print(line)
 
     exit(1)
 
+
 def cmd():
     """
     Runs interactive terminal
     """
     modelFound = False
     modelDir = "out"
+    manifests = discover(modelDir)
 
-    for file in os.listdir("out"):
-        try:
-            h_file = open(modelDir + "/" + file, "rb")
-            model = pickle.load(h_file)
-            h_file.close()
-            modelFound = True
-            break
-        except IOError as e:
-            continue
+    if manifests:
+        model = cached_model(manifests[0]["path"])
+        modelFound = True
+        print("Using", manifests[0]["path"], "|", manifests[0]["kind"], "| accuracy:", manifests[0]["accuracy"])
+    else:
+        # older models were pickled, and can only be found by loading them
+        for file in sorted(os.listdir(modelDir)):
+            try:
+                model = cached_model(modelDir + "/" + file)
+                modelFound = True
+                break
+            except (IOError, ValueError, pickle.UnpicklingError) as e:
+                continue
 
     if (modelFound == False):
+        print("No model found in", modelDir + ", training a new one.")
         model = AdaModel()
         model.train(5)
 
@@ -92,33 +352,86 @@ def main():
     """
     Main function. Accepts user input.
     """
-    if len(sys.argv) < 2:
+    args, opts = options(sys.argv, FLAGS)
+
+    if len(args) < 2:
         usage()
 
-    action = sys.argv[1]
+    action = args[1]
+    workers = int(opts.get("workers", 1))
+    shard_size = int(opts.get("chunk-size", SHARD_SIZE))
+
+    if opts.get("profile"):
+        instrument.enable()
 
     if action == "train":
-        if len(sys.argv) < 5:
-            usage(predict_msg=False)
+        if len(args) < 5:
+            usage("train")
 
-        examples = sys.argv[2]
-        out_file = sys.argv[3]
-        learner = sys.argv[4]
+        examples = args[2]
+        out_file = args[3]
+        learner = args[4]
 
         print("Training...")
-        train(examples, out_file, learner)
+        train(examples, out_file, learner, workers, shard_size, opts.get("cache"), int(opts.get("rounds", 5)),
+              opts.get("resume"), float(opts.get("holdout", 0)), int(opts.get("patience", 3)), ngram_hasher(opts),
+              int(opts.get("sample", 0)), bool(opts.get("keep-weights")))
         print("Done.")
 
     elif action == "predict":
-        if len(sys.argv) < 4:
-            usage(train_msg=False)
+        if len(args) < 4:
+            usage("predict")
+
+        h_file = args[2]
+        test_file = args[3]
+
+        if opts.get("mode") == "batch":
+            predict_batch(h_file, test_file, int(opts.get("chunk-lines", CHUNK_SIZE)),
+                          int(opts.get("cache-lines", 0)), opts.get("report"))
+        else:
+            predict(h_file, test_file, workers, shard_size, int(opts.get("subset", 0)), int(opts.get("seed", 0)),
+                    int(opts.get("mistakes", 10)), opts.get("report"))
 
-        h_file = sys.argv[2]
-        test_file = sys.argv[3]
+    elif action == "update":
+        if len(args) < 4:
+            usage("update")
 
-        predict(h_file, test_file)
+        update(args[2], args[3], args[4] if len(args) > 4 else None, int(opts.get("grace", 200)))
+
+    elif action == "sweep":
+        if len(args) < 3:
+            usage("sweep")
+
+        tune(args[2], int(opts.get("folds", 5)), ints(opts.get("depths", "1,3,5,7,9")), ints(opts.get("rounds", "5,10,20")),
+             workers, int(opts.get("seed", 0)), ngram_hasher(opts), opts.get("report"))
+
+    elif action == "models":
+        models(args[2] if len(args) > 2 else "out")
+
+    elif action == "index":
+        if len(args) < 3:
+            usage("index")
+
+        index(args[2])
+
+    elif action == "convert":
+        if len(args) < 4:
+            usage("convert")
+
+        convert(args[2], args[3])
+
+    elif action == "serve":
+        if len(args) < 3:
+            usage("serve")
+
+        serve(args[2], int(opts.get("port", 8000)), opts.get("socket"), int(opts.get("cache-lines", 100000)))
+
+    if opts.get("profile"):
+        instrument.dump(opts["profile"])
 
 
 if __name__ == '__main__':
-    #main()
-    cmd()
+    if len(sys.argv) > 1:
+        main()
+    else:
+        cmd()
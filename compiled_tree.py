@@ -0,0 +1,297 @@
+from array import array
+
+from d_tree import DNode, vote
+from feature_matrix import Codebook, NO_GOAL
+from instrument import profiled
+
+MISS = 255
+
+
+class CompiledTree:
+    """
+    This class represents a decision tree
+    flattened into parallel arrays. Node 0 is
+    the root. For node n:
+
+     - features[n] is the column index of the
+       feature it splits on, or -1 for a leaf.
+     - labels[n] is the classification code of
+       a leaf, or the precomputed vote of an
+       internal node, or -1 for no classification.
+     - children[offsets[n] + code] is the child
+       reached by a value code, or -1. widths[n]
+       is the number of codes the node has slots
+       for.
+
+    counts, if known, maps a leaf to the count of
+    every classification code of the training
+    examples that reached it.
+    """
+
+    def __init__(self, codebook):
+        """
+        Initialize an empty tree.
+
+        :param codebook: codebook of the tree's codes
+        """
+        self.codebook = codebook
+        self.features = array("h")
+        self.labels = array("h")
+        self.offsets = array("i")
+        self.widths = array("H")
+        self.children = array("i")
+        self.weight = None
+        self.max_depth = None
+        self.counts = None
+
+    def add(self, node):
+        """
+        Appends a node and, recursively, its
+        children.
+
+        :param node: a DNode
+        :return: index of the new node
+        """
+        codebook = self.codebook
+        n = len(self.features)
+
+        if node.is_leaf:
+            label = -1 if node.value is None else codebook.encode_goal(node.value)
+
+            self.features.append(-1)
+            self.labels.append(label)
+            self.offsets.append(len(self.children))
+            self.widths.append(0)
+
+            if node.counts:
+                if self.counts is None:
+                    self.counts = {}
+
+                self.counts[n] = {codebook.encode_goal(goal): count for goal, count in node.counts.items()}
+
+            return n
+
+        column = codebook.add_feature(node.value)
+        codes = {codebook.encode(column, value): child for value, child in node.children.items()}
+        width = max(codes) + 1 if codes else 0
+        majority = vote(node)
+
+        self.features.append(column)
+        self.labels.append(-1 if majority is None else codebook.encode_goal(majority))
+        self.offsets.append(len(self.children))
+        self.widths.append(width)
+        self.children.extend(array("i", [-1] * width))
+
+        for code, child in codes.items():
+            self.children[self.offsets[n] + code] = self.add(child)
+
+        return n
+
+    def size(self):
+        """
+        :return: number of nodes
+        """
+        return len(self.features)
+
+    def detach(self):
+        """
+        Copies arrays that are views of a
+        memory-mapped model file into memory,
+        so the tree outlives changes to the file.
+        """
+        for name in ("features", "labels", "offsets", "widths", "children"):
+            data = getattr(self, name)
+
+            if isinstance(data, memoryview):
+                setattr(self, name, array(data.format, data))
+
+    def translation(self, matrix):
+        """
+        Maps the codes of a matrix onto the
+        tree's codes, one table per column of
+        the tree's codebook.
+
+        :param matrix: feature matrix
+        :return: list of tables, or None if the
+                 matrix shares the tree's codebook
+        """
+        if matrix.codebook is self.codebook:
+            return None
+
+        tables = []
+        other = matrix.codebook
+
+        for column, name in enumerate(self.codebook.names):
+            codes = self.codebook.codes[column]
+            values = other.values[other.index[name]]
+            tables.append(array("B", [codes.get(value, MISS) for value in values]))
+
+        return tables
+
+    @profiled("compiled_predict")
+    def predict(self, matrix):
+        """
+        Classifies every row of a feature matrix.
+
+        :param matrix: feature matrix
+        :return: list of classification codes
+        """
+        return self.walk(matrix, self.labels, "h")
+
+    def reach(self, matrix):
+        """
+        :param matrix: feature matrix
+        :return: list of the nodes the rows of the matrix stop at
+        """
+        return self.walk(matrix, range(self.size()), "i")
+
+    def walk(self, matrix, values, typecode):
+        """
+        Walks every row of a feature matrix down
+        the tree.
+
+        :param matrix: feature matrix
+        :param values: value of every node
+        :param typecode: typecode of the values
+        :return: array of the value of the node every row stops at
+        """
+        features = self.features
+        offsets = self.offsets
+        widths = self.widths
+        children = self.children
+        columns = [matrix.column(name) for name in self.codebook.names]
+        tables = self.translation(matrix)
+        result = array(typecode)
+
+        for i in range(matrix.size()):
+            node = 0
+
+            while True:
+                column = features[node]
+
+                if column < 0:
+                    break
+
+                code = columns[column][i] if tables is None else tables[column][columns[column][i]]
+
+                if code >= widths[node]:
+                    break
+
+                child = children[offsets[node] + code]
+
+                if child < 0:
+                    break
+
+                node = child
+
+            result.append(values[node])
+
+        return result
+
+    def tally(self, matrix):
+        """
+        Counts the classifications of the labeled
+        rows of a feature matrix at the leaves
+        they reach.
+
+        :param matrix: feature matrix sharing the tree's codebook
+        """
+        self.counts = {}
+
+        for i, node in enumerate(self.reach(matrix)):
+            goal = matrix.goals[i]
+
+            if self.features[node] >= 0 or goal == NO_GOAL:
+                continue
+
+            count = self.counts.setdefault(node, {})
+            count[goal] = count.get(goal, 0) + 1
+
+    def decide(self, instance):
+        """
+        Classify an instance of data.
+
+        :param instance: instance of data
+        :return: classification
+        """
+        codebook = self.codebook
+        node = 0
+
+        while self.features[node] >= 0:
+            column = self.features[node]
+            code = codebook.codes[column].get(instance.features[codebook.names[column]], MISS)
+
+            if code >= self.widths[node]:
+                break
+
+            child = self.children[self.offsets[node] + code]
+
+            if child < 0:
+                break
+
+            node = child
+
+        return self.label(self.labels[node])
+
+    def label(self, code):
+        """
+        :param code: classification code
+        :return: the classification
+        """
+        return None if code is None or code < 0 else self.codebook.classes[code]
+
+
+def compile_tree(root, codebook=None):
+    """
+    Flattens a decision tree into a
+    CompiledTree.
+
+    :param root: root DNode of the tree
+    :param codebook: codebook to share with the
+                     matrices the tree will classify
+    :return: the compiled tree
+    """
+    tree = CompiledTree(codebook if codebook else Codebook())
+    tree.add(root)
+    tree.weight = root.weight
+    tree.max_depth = root.max_depth
+
+    return tree
+
+
+def decompile(compiled):
+    """
+    Rebuilds a decision tree from a
+    CompiledTree.
+
+    :param compiled: the compiled tree
+    :return: root DNode of the tree
+    """
+    def build(n):
+        column = compiled.features[n]
+
+        if column < 0:
+            leaf = DNode(compiled.label(compiled.labels[n]), is_leaf=True)
+
+            if compiled.counts and n in compiled.counts:
+                leaf.counts = {codebook.classes[code]: count for code, count in compiled.counts[n].items()}
+
+            return leaf
+
+        node = DNode(codebook.names[column])
+        offset = compiled.offsets[n]
+
+        for code in range(compiled.widths[n]):
+            child = compiled.children[offset + code]
+
+            if child >= 0:
+                node.add(codebook.decode(column, code), build(child))
+
+        return node
+
+    codebook = compiled.codebook
+    root = build(0)
+    root.weight = compiled.weight
+    root.max_depth = compiled.max_depth
+
+    return root
@@ -0,0 +1,304 @@
+import json
+import mmap
+import os
+import random
+import struct
+import sys
+from array import array
+
+from feature_matrix import FeatureMatrix
+from parse import decode_line, raw_lines
+
+MAGIC = b"LCINDEX\0"
+VERSION = 1
+HEADER = struct.Struct("<8sHI")
+
+
+def index_path(filename):
+    """
+    :param filename: corpus file
+    :return: path of the corpus's line index
+    """
+    return filename + ".idx"
+
+
+class LineIndex:
+    """
+    This class indexes the usable lines of a
+    corpus by byte offset, with the label of
+    each, and reads them through a memory map.
+    Subsets, splits and folds are lists of line
+    numbers; only the lines selected are read
+    and featurized.
+    """
+
+    def __init__(self, filename, offsets, ends, labels, codes):
+        """
+        Initialize the index. Use load() instead.
+
+        :param filename: corpus file
+        :param offsets: start offset of every line
+        :param ends: end offset of every line
+        :param labels: list of labels
+        :param codes: label code of every line
+        """
+        self.filename = filename
+        self.offsets = offsets
+        self.ends = ends
+        self.labels = labels
+        self.codes = codes
+        self.map = None
+
+    def size(self):
+        """
+        :return: number of lines
+        """
+        return len(self.offsets)
+
+    def __len__(self):
+        return self.size()
+
+    def line(self, i):
+        """
+        :param i: line number
+        :return: the line
+        """
+        if self.map is None:
+            with open(self.filename, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.ends else b""
+
+        return decode_line(self.map[self.offsets[i]:self.ends[i]])
+
+    def lines(self, rows):
+        """
+        :param rows: line numbers
+        :return: generator of the lines
+        """
+        for i in rows:
+            yield self.line(i)
+
+    def matrix(self, rows, codebook=None, keep_text=True):
+        """
+        Featurizes some lines.
+
+        :param rows: line numbers
+        :param codebook: codebook to extend
+        :param keep_text: keep the text of every line?
+        :return: feature matrix of the lines, in order
+        """
+        matrix = FeatureMatrix(codebook, keep_text)
+        matrix.extend(self.lines(rows))
+
+        return matrix
+
+    def by_label(self, rows=None):
+        """
+        :param rows: line numbers, or None for every line
+        :return: table of label -> line numbers
+        """
+        groups = {label: [] for label in self.labels}
+
+        for i in range(self.size()) if rows is None else rows:
+            groups[self.labels[self.codes[i]]].append(i)
+
+        return groups
+
+    def split(self, share, seed=0):
+        """
+        Splits the lines at random, keeping the
+        share of every label the same on both sides.
+
+        :param share: share of the lines to put in the second part
+        :param seed: random seed
+        :return: two sorted lists of line numbers
+        """
+        return split_groups(self.by_label(), share, seed)
+
+    def stratified(self, size, seed=0):
+        """
+        Draws a random subset of the lines which
+        keeps the share of every label.
+
+        :param size: number of lines
+        :param seed: random seed
+        :return: sorted list of line numbers
+        """
+        return self.split(min(size, self.size()) / self.size() if self.size() else 0, seed)[1]
+
+    def folds(self, k, seed=0):
+        """
+        Cuts the lines into k folds for cross
+        validation, dealing every label's lines
+        out in turn so every fold keeps the
+        share of every label.
+
+        :param k: number of folds
+        :param seed: random seed
+        :return: list of (train, test) pairs of sorted line numbers
+        """
+        return deal_folds(self.by_label(), k, seed)
+
+
+def goal_groups(matrix):
+    """
+    :param matrix: feature matrix of labeled rows
+    :return: table of label -> row indices
+    """
+    groups = {}
+
+    for i in range(matrix.size()):
+        groups.setdefault(matrix.goal(i), []).append(i)
+
+    return groups
+
+
+def split_groups(groups, share, seed=0):
+    """
+    Splits rows at random, keeping the share
+    of every label the same on both sides.
+
+    :param groups: table of label -> row indices
+    :param share: share of the rows to put in the second part
+    :param seed: random seed
+    :return: two sorted lists of row indices
+    """
+    rng = random.Random(seed)
+    first = []
+    second = []
+
+    for label, group in sorted(groups.items()):
+        group = list(group)
+        rng.shuffle(group)
+        cut = int(round(len(group) * share))
+        second.extend(group[:cut])
+        first.extend(group[cut:])
+
+    return sorted(first), sorted(second)
+
+
+def deal_folds(groups, k, seed=0):
+    """
+    Cuts rows into k folds, dealing every
+    label's rows out in turn so every fold
+    keeps the share of every label.
+
+    :param groups: table of label -> row indices
+    :param k: number of folds
+    :param seed: random seed
+    :return: list of (train, test) pairs of sorted row indices
+    """
+    rng = random.Random(seed)
+    shards = [[] for _ in range(k)]
+    n = 0
+
+    for label, group in sorted(groups.items()):
+        group = list(group)
+        rng.shuffle(group)
+
+        for i in group:
+            shards[n % k].append(i)
+            n += 1
+
+    return [(sorted(i for j, shard in enumerate(shards) if j != fold for i in shard), sorted(shards[fold]))
+            for fold in range(k)]
+
+
+def build(filename):
+    """
+    Scans a corpus and writes its line index
+    next to it.
+
+    :param filename: corpus file
+    :return: the index
+    """
+    offsets = array("Q")
+    ends = array("Q")
+    codes = array("B")
+    labels = {}
+    position = 0
+
+    with open(filename, "rb") as f:
+        for raw in raw_lines(f):
+            line = decode_line(raw)
+
+            if line is not None:
+                label = line[:2]
+
+                if label not in labels:
+                    labels[label] = len(labels)
+
+                offsets.append(position)
+                ends.append(position + len(raw))
+                codes.append(labels[label])
+
+            position += len(raw)
+
+    index = LineIndex(filename, offsets, ends, list(labels), codes)
+    write(index)
+
+    return index
+
+
+def write(index):
+    """
+    Writes a line index next to its corpus. It
+    records the corpus's size and modification
+    time, so a changed corpus is indexed again.
+
+    :param index: the index
+    """
+    stat = os.stat(index.filename)
+    meta = json.dumps({
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "byteorder": sys.byteorder,
+        "lines": index.size(),
+        "labels": index.labels,
+    }).encode()
+    path = index_path(index.filename)
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(meta)))
+        f.write(meta)
+        f.write(index.offsets.tobytes())
+        f.write(index.ends.tobytes())
+        f.write(index.codes.tobytes())
+
+    os.replace(path + ".tmp", path)
+
+
+def load(filename):
+    """
+    Loads the line index of a corpus, building
+    it first if it is missing or out of date.
+
+    :param filename: corpus file
+    :return: the index
+    """
+    path = index_path(filename)
+
+    if not os.path.exists(path):
+        return build(filename)
+
+    stat = os.stat(filename)
+
+    with open(path, "rb") as f:
+        magic, version, size = HEADER.unpack(f.read(HEADER.size))
+
+        if magic != MAGIC or version > VERSION:
+            return build(filename)
+
+        meta = json.loads(f.read(size).decode())
+
+        if meta["size"] != stat.st_size or meta["mtime_ns"] != stat.st_mtime_ns or \
+                meta["byteorder"] != sys.byteorder:
+            return build(filename)
+
+        offsets = array("Q")
+        ends = array("Q")
+        codes = array("B")
+        offsets.fromfile(f, meta["lines"])
+        ends.fromfile(f, meta["lines"])
+        codes.fromfile(f, meta["lines"])
+
+    return LineIndex(filename, offsets, ends, meta["labels"], codes)
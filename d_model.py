@@ -1,8 +1,13 @@
-import pickle
+import os
 
-from instance import Instance
-from parse import parse
-from d_tree import d_tree
+import model_file
+from parse import Corpora, SHARD_SIZE
+from d_tree import height, matrix_tree
+from bitset_tree import bitset_tree
+from compiled_tree import compile_tree, decompile
+from feature_matrix import extract
+from metrics import evaluate, score
+from online_tree import OnlineTree
 
 
 class DecisionModel:
@@ -10,55 +15,128 @@ class DecisionModel:
     This class represents a model based on
     decision trees.
     """
+    compiled = None
+    online = None
+    source = None
 
     def __init__(self, train_file="./in/train.dat", test_file="./in/test.dat",
-                 out_file="./out/tree.oj"):
+                 out_file="./out/tree.oj", workers=1, shard_size=SHARD_SIZE, store=None, ngrams=None):
         """
         Initialize the model
 
         :param train_file: training data
         :param test_file: test data
         :param out_file: output data
+        :param workers: feature extraction processes
+        :param shard_size: bytes per extraction task
+        :param store: feature store to reuse features from
+        :param ngrams: NgramHasher adding n-gram features, or None
         """
-        files = (train_file, test_file)
-        lines = parse(files)
-
-        self.data = {"train": lines[0], "test": lines[1]}
+        self.data = Corpora(train_file, test_file, ngrams, workers, shard_size, store)
         self.out_file = out_file
         self.tree = None
+        self.compiled = None
+        self.online = None
 
-    def train(self):
+    def train(self, depth=7, save=True):
         """
         Learns a decision tree and saves
-        the model to a file.
+        the model to a file. Rows are partitioned
+        with bitsets, unless the matrix has n-gram
+        features. The class counts of the training
+        rows at every leaf are kept for updates.
+
+        :param depth: maximum depth of the tree
+        :param save: save the model to its out_file?
         """
         examples = self.data["train"]
-        features = set(examples[0].features.keys())
+        features = examples.codebook.features()
+        rows = list(range(examples.size()))
 
-        self.tree = d_tree(examples, features, [], 7)
+        if examples.ngrams is None and not examples.weights:
+            self.tree = bitset_tree(examples, rows, features, depth)
+        else:
+            self.tree = matrix_tree(examples, rows, features, [], depth)
+        self.tree.max_depth = depth
+        self.compiled = compile_tree(self.tree, examples.codebook)
+        self.compiled.tally(examples)
+        self.online = None
 
-        f = open(self.out_file, "wb")
-        pickle.dump(self, f)
-        f.close()
+        if save:
+            self.save()
 
-    def test(self, test_file=None):
+    def update(self, lines):
         """
-        Tests the model.
+        Grows the tree with new labeled lines
+        instead of retraining on all the data.
 
-        :param test_file: test data
+        :param lines: labeled lines
+        :return: True if the tree changed
         """
-        if not self.tree:
-            self.train()
+        return self.update_block(extract(lines, self.codebook(), keep_text=False))
+
+    def update_block(self, matrix):
+        """
+        Grows the tree with the labeled rows of a
+        feature matrix.
+
+        :param matrix: feature matrix
+        :return: True if the tree changed
+        """
+        online = self.learner()
+
+        if not online.observe(matrix):
+            return False
+
+        self.compiled = compile_tree(self.tree, self.codebook())
+
+        return True
 
-        examples = parse([test_file])[0] if test_file else self.data["test"]
-        result = []
+    def learner(self):
+        """
+        Wraps the tree for incremental updates,
+        up to the depth it was trained to. The
+        leaves start out with the statistics of
+        the training data when it is at hand, or
+        else with the class counts saved with it.
+
+        :return: the online learner
+        """
+        if not self.online:
+            if not self.tree and not self.compiled:
+                self.train()
+
+            if not self.tree:
+                self.tree = decompile(self.compiled)
+
+            examples = self.data.get("train")
+            depth = self.tree.max_depth if self.tree.max_depth is not None else height(self.tree)
+            self.online = OnlineTree(self.tree, set(self.codebook().names), depth, priors=examples is None)
+
+            if examples is not None:
+                self.online.observe(examples, grow=False)
 
-        for ex in examples:
-            d = self.tree.decide(ex)
+        return self.online
 
-            result.append({"value": ex.value, "result": d, "goal": ex.goal})
+    def test(self, test_file=None, workers=1, shard_size=SHARD_SIZE, rows=None, mistakes=10, report=None):
+        """
+        Tests the model, printing the precision and
+        recall of every classification, a sample of
+        misclassified lines and the accuracy.
+
+        :param test_file: test data
+        :param workers: feature extraction processes
+        :param shard_size: bytes per extraction task
+        :param rows: line numbers of the test data to test on,
+                     read through its line index; None for all
+        :param mistakes: misclassified lines to print
+        :param report: file to write the metrics to as JSON, or None
+        :return: the metrics
+        """
+        if not self.tree and not self.compiled:
+            self.train()
 
-        evaluate(result, examples)
+        return evaluate(self, test_file, workers, shard_size, rows, mistakes, report)
 
     def predict(self, line):
         """
@@ -67,35 +145,92 @@ class DecisionModel:
         :param line: line to test
         :return: prediction (en or nl)
         """
-        if not self.tree:
+        if not self.tree and not self.compiled:
             self.train()
 
-        ex = Instance(line, preserve=True)
-        d = self.tree.decide(ex)
-        print("| value:", ex.value, "| result:", d)
+        d = self.predict_block(extract([line], self.codebook(), preserve=True))[0]
+        print("| value:", line, "| result:", d)
         return d
 
-def evaluate(results, examples):
-    """
-    Evaluates results from a model.
+    def predict_block(self, matrix):
+        """
+        Classifies every row of a feature matrix
+        with the compiled tree
 
-    :param results: list of results
-    :param examples: test data
-    """
-    correct = 0
+        :param matrix: feature matrix
+        :return: list of classifications
+        """
+        compiled = self.compile()
 
-    print()
+        return [compiled.label(code) for code in compiled.predict(matrix)]
 
-    for res in results:
-        if res["result"] == res["goal"]:
-            correct += 1
-        else:
-            print("| oops!")
+    def compile(self):
+        """
+        Flattens the tree for fast prediction.
+
+        :return: the compiled tree
+        """
+        if not self.compiled:
+            self.compiled = compile_tree(self.tree)
+
+        return self.compiled
 
-        print("| value:", res["value"][:50], "| result:", res["result"], "| expected:", res["goal"])
+    def codebook(self):
+        """
+        :return: codebook of the compiled tree
+        """
+        return self.compile().codebook
 
-    print()
-    print(str((correct / len(examples)) * 100) + "%", "accuracy")
+    def score(self, matrix):
+        """
+        :param matrix: feature matrix of labeled rows
+        :return: accuracy on the rows, or None if there are none
+        """
+        return score(self, matrix)
+
+    def save(self, out_file=None):
+        """
+        Saves the compiled tree to a model file,
+        with its accuracy on the test data when
+        the model has test data, and the class
+        counts of its leaves. A model loaded from
+        the same file first copies its mapped arrays.
+
+        :param out_file: output file, defaults to
+                         the model's out_file
+        """
+        path = out_file if out_file else self.out_file
+        test = self.data.get("test") if isinstance(self.data, Corpora) else None
+        accuracy = self.score(test) if test is not None else None
+
+        if self.online:
+            self.online.record()
+            self.compiled = compile_tree(self.tree, self.codebook())
+
+        if self.source and os.path.abspath(path) == os.path.abspath(self.source):
+            self.compile().detach()
+
+        model_file.write(path, "dt", [self.compile()], accuracy=accuracy)
+
+
+def from_compiled(compiled, out_file):
+    """
+    Builds a model around a compiled tree
+    without reading any data.
+
+    :param compiled: the compiled tree
+    :param out_file: output data
+    :return: the model
+    """
+    model = DecisionModel.__new__(DecisionModel)
+    model.data = Corpora()
+    model.out_file = out_file
+    model.tree = None
+    model.compiled = compiled
+    model.online = None
+    model.source = out_file
+
+    return model
 
 
 def main():
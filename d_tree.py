@@ -1,6 +1,9 @@
 import math
 
+from instrument import profiled, PROFILER
 
+
+@profiled("d_tree")
 def d_tree(examples, features, parent_examples, depth=20):
     """
     Builds the decision tree, selecting features
@@ -13,6 +16,9 @@ def d_tree(examples, features, parent_examples, depth=20):
 
     :return: The root node of a decision tree
     """
+    if PROFILER.enabled:
+        PROFILER.observe("examples_per_node", len(examples))
+
     if not examples:
         return DNode(plurality_value(parent_examples), is_leaf=True)
     if same_goal(examples):
@@ -42,8 +48,13 @@ def d_tree(examples, features, parent_examples, depth=20):
 class DNode:
     """
     This class represents a single node in
-    a decision tree.
+    a decision tree. A leaf may hold the count
+    of every classification of the training
+    examples that reached it, and a root the
+    maximum depth the tree was grown to.
     """
+    counts = None
+    max_depth = None
 
     def __init__(self, value, is_leaf=False):
         """
@@ -57,6 +68,9 @@ class DNode:
         self.children = {}
         self.weight = None
 
+        if PROFILER.enabled:
+            PROFILER.count("nodes_built")
+
     def add(self, label, d_node):
         """
         Adds a child to the node.
@@ -81,6 +95,7 @@ class DNode:
         for key in self.children:
             self.children[key].print()
 
+    @profiled("decide")
     def decide(self, instance):
         """
         Classify an instance of data.
@@ -104,6 +119,18 @@ class DNode:
         return None
 
 
+def height(node):
+    """
+    :param node: root of a tree
+    :return: number of splits on the tree's longest path
+    """
+    if node.is_leaf or not node.children:
+        return 0
+
+    return 1 + max(height(child) for child in node.children.values())
+
+
+@profiled("vote")
 def vote(node):
     """
     Get the majority classification from a
@@ -211,10 +238,14 @@ def entropy(examples):
     return total
 
 
+@profiled("max_gain")
 def max_gain(examples, features):
     """
     Finds a split of the example list which
-    leads to the most information gain.
+    leads to the most information gain. Every
+    feature is scored from count tables built
+    in one pass; only the best feature's split
+    is materialized.
 
     :param examples: list of examples
     :param features: set of features
@@ -222,44 +253,79 @@ def max_gain(examples, features):
     :return: feature and split with max gain.
     """
     entrpy = entropy(examples)
+    tables = count_values(examples, features)
     max_val = -1
     max_feature = None
-    children = None
 
     for feature in features:
-        gains, kids = gain(examples, feature, entrpy)
+        total = 0
+
+        for size, count in tables[feature].values():
+            total += (size/len(examples)) * counts_entropy(count.values(), size)
+
+        gains = entrpy - total
 
         if gains > max_val:
             max_val = gains
             max_feature = feature
-            children = kids
 
-    return max_feature, children
+    return max_feature, split(examples, max_feature)
 
 
-def gain(examples, feature, entrpy):
+def count_values(examples, features):
     """
-    Calculates the information gain after
-    splitting examples on a feature.
+    Counts the examples with each value of
+    each feature, and the weight of every
+    classification among them.
 
     :param examples: list of examples
-    :param feature: feature to split on
-    :param entrpy: current entropy
+    :param features: set of features
 
-    :return: information gain
+    :return: table of feature -> value -> [size, count of every classification]
     """
-    kids = split(examples, feature)
-    total = 0
+    tables = {feature: {} for feature in features}
+
+    for ex in examples:
+        weight = ex.weight if ex.weight else 1
+        values = ex.features
+
+        for feature in features:
+            table = tables[feature]
+            value = values[feature]
+
+            if value in table:
+                entry = table[value]
+                entry[0] += 1
+            else:
+                entry = table[value] = [1, {}]
+
+            count = entry[1]
 
-    for kid in kids:
-        exs = kids[kid]
-        total += (len(exs)/len(examples)) * entropy(exs)
+            if ex.goal in count:
+                count[ex.goal] += weight
+            else:
+                count[ex.goal] = weight
 
-    gains = entrpy - total
+    return tables
 
-    return gains, kids
 
+def counts_entropy(counts, size):
+    """
+    :param counts: weight of every classification
+    :param size: number of examples counted
+    :return: entropy of the counts
+    """
+    total = 0
+
+    for c in counts:
+        if c:
+            p = c/size
+            total += -p * math.log(p, 2)
+
+    return total
 
+
+@profiled("split")
 def split(examples, feature):
     """
     Splits a list of examples on a feature.
@@ -280,3 +346,268 @@ def split(examples, feature):
             result[value] = [ex]
 
     return result
+
+
+@profiled("matrix_tree")
+def matrix_tree(matrix, rows, features, parent_rows, depth=20):
+    """
+    Builds the decision tree from rows of a
+    feature matrix, selecting features based
+    on information gain.
+
+    :param matrix: feature matrix
+    :param rows: indices of the training rows
+    :param features: set of feature names
+    :param parent_rows: parent's row indices
+    :param depth: maximum depth
+
+    :return: The root node of a decision tree
+    """
+    if PROFILER.enabled:
+        PROFILER.observe("examples_per_node", len(rows))
+
+    if not rows:
+        return DNode(matrix_plurality(matrix, parent_rows), is_leaf=True)
+
+    count = matrix_count_goals(matrix, rows)
+
+    if len(count) == 1:
+        return DNode(matrix.goal(rows[0]), is_leaf=True)
+    if not features:
+        return DNode(matrix_plurality(matrix, rows), is_leaf=True)
+
+    feature, kids = matrix_max_gain(matrix, rows, features)
+    column = matrix.codebook.index[feature]
+    root = DNode(feature)
+
+    if depth < 1:
+        depth = 1
+
+    for code in kids:
+        value = matrix.codebook.decode(column, code)
+        sub_rows = kids[code]
+
+        if depth == 1:
+            subtree = DNode(matrix_plurality(matrix, sub_rows), is_leaf=True)
+        else:
+            subtree = matrix_tree(matrix, sub_rows, features.difference({feature}), rows, depth - 1)
+
+        root.add(value, subtree)
+
+    return root
+
+
+def matrix_count_goals(matrix, rows):
+    """
+    Counts the number of rows for each
+    classification code. Takes the matrix
+    weights into consideration.
+
+    :param matrix: feature matrix
+    :param rows: row indices
+    :return: count of every classification code
+    """
+    count = {}
+    goals = matrix.goals
+    weights = matrix.weights
+
+    for i in rows:
+        goal = goals[i]
+        weight = weights[i] if weights else 1
+
+        if goal in count:
+            count[goal] += weight
+        else:
+            count[goal] = weight
+
+    return count
+
+
+def matrix_plurality(matrix, rows):
+    """
+    Gets the majority classification from
+    rows of a feature matrix.
+
+    :param matrix: feature matrix
+    :param rows: row indices
+    :return: majority classification
+    """
+    code = None
+    max_weight = -1
+    count = matrix_count_goals(matrix, rows)
+
+    for goal in count:
+        if count[goal] > max_weight:
+            max_weight = count[goal]
+            code = goal
+
+    return None if code is None else matrix.codebook.decode_goal(code)
+
+
+def matrix_entropy(matrix, rows):
+    """
+    :param matrix: feature matrix
+    :param rows: row indices
+    :return: entropy of the rows
+    """
+    return counts_entropy(matrix_count_goals(matrix, rows).values(), len(rows))
+
+
+@profiled("matrix_max_gain")
+def matrix_max_gain(matrix, rows, features):
+    """
+    Finds a split of the rows which leads
+    to the most information gain. Every
+    feature is scored from a (value x class)
+    count table; only the best feature's
+    split is materialized.
+
+    :param matrix: feature matrix
+    :param rows: row indices
+    :param features: set of feature names
+
+    :return: feature and split with max gain.
+    """
+    codebook = matrix.codebook
+    goals = matrix.goals
+    weights = matrix.weights
+    n_classes = len(codebook.classes)
+    entrpy = matrix_entropy(matrix, rows)
+    max_val = -1
+    max_feature = None
+
+    for feature in codebook.names:
+        if feature not in features or feature in codebook.buckets:
+            continue
+
+        column = matrix.column(feature)
+        n_values = len(codebook.values[codebook.index[feature]])
+        sizes = [0] * n_values
+        table = [0] * (n_values * n_classes)
+
+        if weights:
+            for i in rows:
+                code = column[i]
+                sizes[code] += 1
+                table[code * n_classes + goals[i]] += weights[i]
+        else:
+            for i in rows:
+                code = column[i]
+                sizes[code] += 1
+                table[code * n_classes + goals[i]] += 1
+
+        total = 0
+
+        for code in range(n_values):
+            size = sizes[code]
+
+            if size:
+                start = code * n_classes
+                total += (size/len(rows)) * counts_entropy(table[start:start + n_classes], size)
+
+        gains = entrpy - total
+
+        if gains > max_val:
+            max_val = gains
+            max_feature = feature
+
+    if matrix.ngrams is not None:
+        gains, feature = matrix_max_ngram_gain(matrix, rows, features, entrpy)
+
+        if gains > max_val:
+            max_val = gains
+            max_feature = feature
+
+    return max_feature, matrix_split(matrix, rows, max_feature)
+
+
+def matrix_max_ngram_gain(matrix, rows, features, entrpy):
+    """
+    Finds the n-gram bucket whose presence
+    splits the rows with the most information
+    gain. The (bucket x class) count table is
+    built from the sparse rows; absent counts
+    are the totals minus the present ones.
+
+    :param matrix: feature matrix with n-gram counts
+    :param rows: row indices
+    :param features: set of feature names
+    :param entrpy: entropy of the rows
+
+    :return: gain and name of the best bucket
+    """
+    hasher = matrix.codebook.hasher
+    n_classes = len(matrix.codebook.classes)
+    goals = matrix.goals
+    weights = matrix.weights
+    indptr = matrix.ngrams.indptr
+    indices = matrix.ngrams.indices
+    sizes = [0] * hasher.buckets
+    table = [0] * (hasher.buckets * n_classes)
+    totals = [0] * n_classes
+    n = len(rows)
+
+    for i in rows:
+        goal = goals[i]
+        weight = weights[i] if weights else 1
+        totals[goal] += weight
+
+        for k in range(indptr[i], indptr[i + 1]):
+            bucket = indices[k]
+            sizes[bucket] += 1
+            table[bucket * n_classes + goal] += weight
+
+    max_val = -1
+    max_feature = None
+
+    for bucket in range(hasher.buckets):
+        size = sizes[bucket]
+
+        if not size:
+            continue
+
+        name = hasher.name(bucket)
+
+        if name not in features:
+            continue
+
+        present = table[bucket * n_classes:(bucket + 1) * n_classes]
+        absent = [max(t - p, 0) for t, p in zip(totals, present)]
+        total = (size/n) * counts_entropy(present, size)
+
+        if n > size:
+            total += ((n - size)/n) * counts_entropy(absent, n - size)
+
+        gains = entrpy - total
+
+        if gains > max_val:
+            max_val = gains
+            max_feature = name
+
+    return max_val, max_feature
+
+
+@profiled("matrix_split")
+def matrix_split(matrix, rows, feature):
+    """
+    Splits rows of a feature matrix on a
+    feature.
+
+    :param matrix: feature matrix
+    :param rows: row indices
+    :param feature: feature to split on.
+
+    :return: table of value codes to row indices.
+    """
+    result = {}
+    column = matrix.column(feature)
+
+    for i in rows:
+        code = column[i]
+
+        if code in result:
+            result[code].append(i)
+        else:
+            result[code] = [i]
+
+    return result
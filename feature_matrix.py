@@ -0,0 +1,381 @@
+from array import array
+
+from instance import get_features
+from ngrams import SparseRows
+
+NO_GOAL = 255
+
+
+class Codebook:
+    """
+    This class maps feature names, feature
+    values and classifications to small
+    integer codes. With a hasher, the n-gram
+    bucket features used so far also get
+    columns, whose values are False and True.
+    """
+
+    def __init__(self, names=(), hasher=None):
+        """
+        Initialize the codebook.
+
+        :param names: feature names, in column order
+        :param hasher: NgramHasher of the n-gram features
+        """
+        self.names = []
+        self.index = {}
+        self.values = []
+        self.codes = []
+        self.classes = []
+        self.class_codes = {}
+        self.hasher = hasher
+        self.buckets = {}
+
+        for name in names:
+            self.add_feature(name)
+
+    def add_feature(self, name):
+        """
+        Adds a feature to the codebook.
+
+        :param name: the feature name
+        :return: column index of the feature
+        """
+        if name not in self.index:
+            self.index[name] = len(self.names)
+            self.names.append(name)
+            self.values.append([])
+            self.codes.append({})
+
+            bucket = self.hasher.bucket(name) if self.hasher else None
+
+            if bucket is not None:
+                self.buckets[name] = bucket
+                self.encode(self.index[name], False)
+                self.encode(self.index[name], True)
+
+        return self.index[name]
+
+    def features(self):
+        """
+        :return: set of every feature name a tree
+                 can split on, n-gram buckets included
+        """
+        names = set(self.names)
+
+        if self.hasher:
+            names.update(self.hasher.names())
+
+        return names
+
+    def encode(self, column, value):
+        """
+        Gets the code of a feature value, adding
+        the value to the codebook if it is new.
+
+        :param column: column index of the feature
+        :param value: the feature value
+        :return: code of the value
+        """
+        codes = self.codes[column]
+
+        if value in codes:
+            return codes[value]
+
+        code = len(self.values[column])
+
+        if code > 255:
+            raise ValueError("too many values for feature " + self.names[column])
+
+        codes[value] = code
+        self.values[column].append(value)
+
+        return code
+
+    def encode_features(self, features):
+        """
+        Gets the codes of a table of features,
+        adding new features and values to the
+        codebook.
+
+        :param features: table of features
+        :return: list of codes, in column order
+        """
+        for name in features:
+            if name not in self.index:
+                self.add_feature(name)
+
+        return [self.encode(column, features[name]) for column, name in enumerate(self.names)]
+
+    def decode(self, column, code):
+        """
+        :param column: column index of the feature
+        :param code: code of a value
+        :return: the feature value
+        """
+        return self.values[column][code]
+
+    def encode_goal(self, goal):
+        """
+        Gets the code of a classification, adding
+        it to the codebook if it is new.
+
+        :param goal: the classification
+        :return: code of the classification
+        """
+        if goal is None:
+            return NO_GOAL
+
+        if goal not in self.class_codes:
+            if len(self.classes) == NO_GOAL:
+                raise ValueError("too many classifications")
+
+            self.class_codes[goal] = len(self.classes)
+            self.classes.append(goal)
+
+        return self.class_codes[goal]
+
+    def decode_goal(self, code):
+        """
+        :param code: code of a classification
+        :return: the classification
+        """
+        return None if code == NO_GOAL else self.classes[code]
+
+
+class FeatureMatrix:
+    """
+    This class represents many instances of
+    input data as integer coded columns, one
+    column per feature.
+    """
+
+    def __init__(self, codebook=None, keep_text=True):
+        """
+        Initialize an empty matrix. If the codebook
+        has a hasher, the n-gram counts of every
+        row are kept as sparse rows, and the column
+        of an n-gram bucket is only filled in when
+        it is first asked for.
+
+        :param codebook: codebook shared with other matrices
+        :param keep_text: keep the text of every line?
+        """
+        self.codebook = codebook if codebook else Codebook()
+        self.columns = [array("B") for _ in self.codebook.names]
+        self.goals = array("B")
+        self.values = [] if keep_text else None
+        self.weights = None
+        self.ngrams = SparseRows() if self.codebook.hasher else None
+
+    def append(self, line, preserve=False, cache=None):
+        """
+        Extracts the features of a line and adds
+        them to the matrix as a new row.
+
+        :param line: the input line
+        :param preserve: strip a line or not?
+        :param cache: feature cache to look the line up in
+        """
+        if preserve:
+            goal = None
+            value = line
+        else:
+            goal = line[:2]
+            value = line[2:]
+
+        if self.ngrams is not None:
+            codes = self.add_ngrams(line, value)
+        elif cache is not None:
+            codes = cache.lookup(line, self.codebook)
+        else:
+            codes = self.codebook.encode_features(get_features(line))
+
+        self.add_row(codes, goal, value)
+
+    def add_ngrams(self, line, value):
+        """
+        Adds the n-gram counts of a row and gets
+        the codes of all its features, including
+        the n-gram buckets that have columns.
+
+        :param line: the input line
+        :param value: the line's text, without its label
+        :return: list of codes, in column order
+        """
+        codebook = self.codebook
+        indices, counts = codebook.hasher.vector(value)
+        features = get_features(line)
+
+        if codebook.buckets:
+            present = set(indices)
+
+            for name, bucket in codebook.buckets.items():
+                self.column(name)
+                features[name] = bucket in present
+
+        self.ngrams.add(indices, counts)
+
+        return codebook.encode_features(features)
+
+    def add_row(self, codes, goal, value=None):
+        """
+        Adds a row of codes to the matrix.
+
+        :param codes: list of codes, in column order
+        :param goal: the row's classification
+        :param value: the row's text
+        """
+        columns = self.columns
+
+        while len(columns) < len(codes):
+            columns.append(array("B"))
+
+        for column, code in enumerate(codes):
+            columns[column].append(code)
+
+        self.goals.append(self.codebook.encode_goal(goal))
+
+        if self.values is not None:
+            self.values.append(value)
+
+    def extend(self, lines, preserve=False):
+        """
+        Adds many lines to the matrix.
+
+        :param lines: the input lines
+        :param preserve: strip lines or not?
+        """
+        for line in lines:
+            self.append(line, preserve)
+
+    def merge(self, other):
+        """
+        Appends the rows of another matrix,
+        translating its codes into this
+        matrix's codebook.
+
+        :param other: a feature matrix
+        """
+        codebook = self.codebook
+
+        for j, name in enumerate(other.codebook.names):
+            column = codebook.add_feature(name)
+            codes = [codebook.encode(column, value) for value in other.codebook.values[j]]
+            source = other.column(name)
+
+            while len(self.columns) <= column:
+                self.columns.append(array("B"))
+
+            if name in codebook.buckets:
+                self.column(name)
+
+            if codes == list(range(len(codes))):
+                self.columns[column].extend(source)
+            else:
+                self.columns[column].extend(array("B", [codes[code] for code in source]))
+
+        goals = [codebook.encode_goal(goal) for goal in other.codebook.classes]
+        self.goals.extend(array("B", [NO_GOAL if code == NO_GOAL else goals[code] for code in other.goals]))
+
+        if self.values is not None:
+            self.values.extend(other.values)
+
+        if self.ngrams is not None:
+            if other.ngrams is None:
+                raise ValueError("the merged matrix has no n-gram features")
+
+            self.ngrams.extend(other.ngrams)
+
+    def take(self, rows):
+        """
+        Copies some rows into a new matrix that
+        shares this matrix's codebook. n-gram
+        bucket columns not yet filled in stay
+        that way.
+
+        :param rows: row indices
+        :return: matrix of the rows, in order
+        """
+        matrix = FeatureMatrix(self.codebook, self.values is not None)
+        size = self.size()
+        matrix.columns = [array("B", [column[i] for i in rows]) if len(column) == size else array("B")
+                          for column in self.columns]
+        matrix.goals = array("B", [self.goals[i] for i in rows])
+
+        if self.values is not None:
+            matrix.values = [self.values[i] for i in rows]
+
+        if self.ngrams is not None:
+            for i in rows:
+                matrix.ngrams.add(*self.ngrams.row(i))
+
+        return matrix
+
+    def column(self, name):
+        """
+        Gets the column of a feature. The column
+        of an n-gram bucket is filled in from the
+        sparse rows as needed.
+
+        :param name: feature name
+        :return: the feature's column of codes
+        """
+        codebook = self.codebook
+
+        if name not in codebook.index and codebook.hasher and codebook.hasher.bucket(name) is not None:
+            codebook.add_feature(name)
+
+        index = codebook.index[name]
+
+        while len(self.columns) <= index:
+            self.columns.append(array("B"))
+
+        column = self.columns[index]
+
+        if name in codebook.buckets and len(column) < self.size():
+            column.extend(self.ngrams.presence(codebook.buckets[name], len(column), self.size()))
+
+        return column
+
+    def value(self, name, i):
+        """
+        :param name: feature name
+        :param i: row index
+        :return: value of the feature in row i
+        """
+        return self.codebook.values[self.codebook.index[name]][self.column(name)[i]]
+
+    def goal(self, i):
+        """
+        :param i: row index
+        :return: classification of row i
+        """
+        return self.codebook.decode_goal(self.goals[i])
+
+    def size(self):
+        """
+        :return: number of rows
+        """
+        return len(self.goals)
+
+    def __len__(self):
+        return self.size()
+
+
+def extract(lines, codebook=None, preserve=False, keep_text=True):
+    """
+    Extracts the features of many lines into
+    a single matrix.
+
+    :param lines: the input lines
+    :param codebook: codebook shared with other matrices
+    :param preserve: strip lines or not?
+    :param keep_text: keep the text of every line?
+
+    :return: a feature matrix
+    """
+    matrix = FeatureMatrix(codebook, keep_text)
+    matrix.extend(lines, preserve)
+
+    return matrix
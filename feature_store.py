@@ -0,0 +1,151 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+from instance import FEATURE_VERSION, get_features
+
+
+class FeatureStore:
+    """
+    This class keeps extracted feature matrices
+    on disk, so later runs over the same corpus
+    skip feature extraction. Entries are keyed by
+    the corpus file (path, size and modification
+    time), the feature-set version and the n-gram
+    hasher.
+    """
+
+    def __init__(self, directory="./cache"):
+        """
+        Initialize the store.
+
+        :param directory: directory holding the entries
+        """
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, filename, keep_text, hasher=None):
+        """
+        :param filename: corpus file
+        :param keep_text: does the entry keep the text of every line?
+        :param hasher: NgramHasher of the entry's n-gram features
+        :return: path of the corpus's entry
+        """
+        stat = os.stat(filename)
+        key = "|".join((os.path.abspath(filename), str(stat.st_size), str(stat.st_mtime_ns),
+                        str(FEATURE_VERSION), str(keep_text), repr(hasher)))
+
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".fm")
+
+    def load(self, filename, keep_text=True, hasher=None):
+        """
+        :param filename: corpus file
+        :param keep_text: keep the text of every line?
+        :param hasher: NgramHasher of the n-gram features
+        :return: the stored matrix, or None
+        """
+        path = self.path(filename, keep_text, hasher)
+
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+
+        with open(path, "rb") as f:
+            matrix = pickle.load(f)
+
+        self.hits += 1
+
+        return matrix
+
+    def save(self, filename, matrix, keep_text=True, hasher=None):
+        """
+        Stores the matrix extracted from a corpus.
+
+        :param filename: corpus file
+        :param matrix: the extracted matrix
+        :param keep_text: does the matrix keep the text of every line?
+        :param hasher: NgramHasher of the matrix's n-gram features
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(filename, keep_text, hasher)
+        weights = matrix.weights
+        matrix.weights = None
+
+        try:
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(matrix, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            matrix.weights = weights
+
+        os.replace(path + ".tmp", path)
+
+
+class FeatureCache:
+    """
+    This class is a bounded, least recently used
+    cache of the feature codes of lines, keyed by
+    a hash of the line. The codes are only valid
+    for one codebook, so the cache empties itself
+    when used with another.
+    """
+
+    def __init__(self, capacity=100000):
+        """
+        Initialize the cache.
+
+        :param capacity: most lines to keep
+        """
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.codebook = None
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, line, codebook):
+        """
+        Gets the feature codes of a line, extracting
+        them on a miss.
+
+        :param line: the input line
+        :param codebook: codebook of the codes
+        :return: list of codes, in column order
+        """
+        if codebook is not self.codebook:
+            self.entries.clear()
+            self.codebook = codebook
+
+        key = (hash(line), len(line))
+        codes = self.entries.get(key)
+
+        if codes is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return codes
+
+        self.misses += 1
+        codes = codebook.encode_features(get_features(line))
+        self.entries[key] = codes
+
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+        return codes
+
+    def __len__(self):
+        return len(self.entries)
+
+    def report(self):
+        """
+        :return: table of the cache's counters
+        """
+        total = self.hits + self.misses
+
+        return {
+            "size": len(self.entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0,
+        }
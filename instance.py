@@ -1,10 +1,100 @@
+from array import array
+from collections.abc import Mapping
+
+from instrument import profiled
+
+# Bump whenever get_features changes, so stored features are recomputed.
+FEATURE_VERSION = 1
+
+
+class FeatureTable:
+    """
+    This class interns the feature names and
+    values of every Instance, so an instance
+    only keeps one small integer code per
+    feature.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty table.
+        """
+        self.names = []
+        self.index = {}
+        self.values = []
+        self.codes = []
+
+    def encode(self, features):
+        """
+        :param features: table of features
+        :return: array of codes, in column order
+        """
+        for name in features:
+            if name not in self.index:
+                self.index[name] = len(self.names)
+                self.names.append(name)
+                self.values.append([])
+                self.codes.append({})
+
+        result = array("H")
+
+        for column, name in enumerate(self.names):
+            value = features[name]
+            codes = self.codes[column]
+            code = codes.get(value)
+
+            if code is None:
+                code = codes[value] = len(self.values[column])
+                self.values[column].append(value)
+
+            result.append(code)
+
+        return result
+
+
+TABLE = FeatureTable()
+
+
+class FeatureView(Mapping):
+    """
+    This class is a read-only table of the
+    features of an Instance, decoded from
+    its codes on access.
+    """
+    __slots__ = ("codes",)
+
+    def __init__(self, codes):
+        """
+        :param codes: array of codes, in column order
+        """
+        self.codes = codes
+
+    def __getitem__(self, name):
+        column = TABLE.index[name]
+
+        try:
+            return TABLE.values[column][self.codes[column]]
+        except IndexError:
+            raise KeyError(name)
+
+    def __iter__(self):
+        return iter(TABLE.names[:len(self.codes)])
+
+    def __len__(self):
+        return len(self.codes)
+
+
 class Instance:
     """
     This class represents a single instance of
-    input data.
+    input data. Its features are kept as an
+    array of codes into a shared FeatureTable,
+    and its text only when asked for; goal,
+    value, features and weight read as before.
     """
+    __slots__ = ("goal", "value", "codes", "weight")
 
-    def __init__(self, line, preserve=False):
+    def __init__(self, line, preserve=False, keep_text=False):
         """
         Initializes an instance with a line of
         text. Features are extracted from the line
@@ -12,6 +102,7 @@ class Instance:
 
         :param line: The input line
         :param preserve: strip a line or not?
+        :param keep_text: keep the text of the line?
         """
         if preserve:
             self.goal = None
@@ -19,13 +110,147 @@ class Instance:
         else:
             self.goal = line[:2]
             self.value = line[2:]
-        self.features = get_features(line)
+
+        if not keep_text:
+            self.value = None
+
+        self.codes = TABLE.encode(get_features(line))
         self.weight = None
 
+    @property
+    def features(self):
+        """
+        :return: table of the instance's features
+        """
+        return FeatureView(self.codes)
+
+    @features.setter
+    def features(self, features):
+        self.codes = TABLE.encode(features)
+
+    def __getstate__(self):
+        return {"goal": self.goal, "value": self.value, "features": dict(self.features), "weight": self.weight}
+
+    def __setstate__(self, state):
+        """
+        Restores a pickled instance, including
+        ones pickled before instances had slots.
+
+        :param state: table of attributes
+        """
+        if isinstance(state, tuple):
+            state = state[0] or state[1]
+
+        self.goal = state.get("goal")
+        self.value = state.get("value")
+        self.features = state["features"]
+        self.weight = state.get("weight")
+
 
+VOWELS = frozenset("aeiou")
+
+
+@profiled("get_features")
 def get_features(line):
     """
-    Gets the features of a line.
+    Gets the features of a line in a single
+    left-to-right pass. Gives the same results
+    as reference_features, which computes each
+    feature with its own function.
+
+    :param line: The line to be operated on
+    :return: table of features
+    """
+    v_count = l_pairs = v_pairs = c_pairs = n_words = 0
+    ends_en = ends_e = has_aa = has_ee = False
+    words = set()
+    prev = None
+    paired = False
+    start = -1
+
+    for i, ch in enumerate(line):
+        vowel = ch in VOWELS
+
+        if vowel:
+            v_count += 1
+
+        if ch == prev:
+            l_pairs += 1
+
+            # vow_con_pairs does not let pairs overlap
+            if paired:
+                paired = False
+            else:
+                paired = True
+
+                if vowel:
+                    v_pairs += 1
+                else:
+                    c_pairs += 1
+
+            if ch == "a":
+                has_aa = True
+            elif ch == "e":
+                has_ee = True
+        else:
+            paired = False
+
+        if ch.isspace():
+            if start >= 0:
+                n_words += 1
+
+                if prev == "e":
+                    ends_e = True
+                elif prev == "n" and i - start > 1 and line[i - 2] == "e":
+                    ends_en = True
+
+                # every word looked up below is at most 3 letters long
+                if i - start <= 3:
+                    words.add(line[start:i])
+
+                start = -1
+        elif start < 0:
+            start = i
+
+        prev = ch
+
+    if start >= 0:
+        n_words += 1
+
+        if prev == "e":
+            ends_e = True
+        elif prev == "n" and len(line) - start > 1 and line[-2] == "e":
+            ends_en = True
+
+        if len(line) - start <= 3:
+            words.add(line[start:])
+
+    return {
+        "cv-ratio": ratio_range(v_count, len(line) - v_count),
+        "av-len": word_len_range(len(line) // n_words),
+        "v-pairs": pair_range(v_pairs),
+        "c-pairs": pair_range(c_pairs),
+        "l-pairs": pair_range(l_pairs),
+        "ends-en": ends_en,
+        "ends-e": ends_e,
+        "has-aa": has_aa,
+        "has-ee": has_ee,
+        "has-word-het": "het" in words,
+        "has-word-een": "een" in words,
+        "has-word-en": "en" in words,
+        "has-word-de": "de" in words,
+        "has-word-the": "the" in words,
+        "has-word-and": "and" in words,
+        "has-word-in": "in" in words,
+        "has-word-of": "of" in words,
+    }
+
+
+def reference_features(line):
+    """
+    Gets the features of a line, one feature
+    function at a time. Slower than
+    get_features; kept to check it against.
 
     :param line: The line to be operated on
     :return: table of features
@@ -166,14 +391,21 @@ def avg_word_len(line):
     :return: range of average length of words in the line
     """
     total = 0
-    range1 = 0, 4
-    range2 = 5, 8
-    range3 = 8, None
 
     for _ in line:
         total += 1
 
-    avg = total//len(line.split())
+    return word_len_range(total//len(line.split()))
+
+
+def word_len_range(avg):
+    """
+    :param avg: average length of words in a line
+    :return: range of the average
+    """
+    range1 = 0, 4
+    range2 = 5, 8
+    range3 = 8, None
 
     if avg <= 4:
         return range1
@@ -191,16 +423,26 @@ def vow_con_ratio(line):
     """
     vowels = {"a", "e", "i", "o", "u"}
     v_count = c_count = 0
-    range1 = 0, 0.5
-    range2 = 0.51, 0.69
-    range3 = 0.7, None
 
     for ch in line:
         if ch in vowels:
             v_count += 1
         else:
             c_count += 1
-    
+
+    return ratio_range(v_count, c_count)
+
+
+def ratio_range(v_count, c_count):
+    """
+    :param v_count: number of vowels
+    :param c_count: number of other characters
+    :return: range of the ratio of vowels to
+             other characters.
+    """
+    range1 = 0, 0.5
+    range2 = 0.51, 0.69
+    range3 = 0.7, None
     ratio = v_count/c_count
 
     if ratio <= range1[1]:
@@ -210,3 +452,67 @@ def vow_con_ratio(line):
         return range2
 
     return range3
+
+
+# lines that exercise the edges of the single pass in get_features
+EDGE_CASES = (
+    "en|the cat and the hat",
+    "nl|een aap en de beer",
+    "nl|heen\tgaan  en\t\tkomen",
+    "en|word ending in e\n",
+    "nl|zij lopen\n",
+    "nl|ee aa eee aaa",
+    "nl|taal  zee\tmeer",
+    "en|  leading and trailing  ",
+    "nl| een woord ",
+    "en|line\rwith\x1cseparators",
+    "nl|aaaa eeee oooo",
+    "en|bookkeeper coffee",
+    "nl|en",
+    "e n|x",
+    "xx|n",
+    "en|of in de het the",
+    "nl|ÉÉN ééN één",
+)
+
+
+def outcome(fn, line):
+    """
+    :param fn: feature function
+    :param line: a line
+    :return: the features of the line, or the type
+             of the error the function raised on it
+    """
+    try:
+        return fn(line)
+    except Exception as e:
+        return type(e)
+
+
+def main(lines=200000, seed=0):
+    """
+    Main function. (Test) Checks that get_features
+    and reference_features agree, on edge cases and
+    on random lines of letters and whitespace.
+
+    :param lines: number of random lines
+    :param seed: random seed
+    """
+    import random
+
+    rng = random.Random(seed)
+    alphabet = "aaeeeiounnhtdrsk" + " " * 4 + "\t\n\r " + "éÉß"
+    checked = 0
+
+    for line in EDGE_CASES + tuple("".join(rng.choice(alphabet) for _ in range(rng.randint(1, 40)))
+                                   for _ in range(lines)):
+        expected = outcome(reference_features, line)
+        actual = outcome(get_features, line)
+        assert actual == expected, repr(line) + ": " + repr(actual) + " != " + repr(expected)
+        checked += 1
+
+    print("| get_features agrees with reference_features on", checked, "lines")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import functools
+import json
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class Profiler:
+    """
+    This class records, per stage, wall time,
+    call counts and the memory high-water mark,
+    plus named counters and observations. It
+    records nothing until it is enabled.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty, disabled profiler.
+        """
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets everything recorded so far.
+        """
+        self.stages = {}
+        self.active = {}
+        self.counters = {}
+        self.observations = {}
+
+    def enter(self, name):
+        """
+        Marks the start of a call to a stage.
+
+        :param name: stage name
+        :return: start time, or None for a nested
+                 call of a stage already running
+        """
+        if name not in self.stages:
+            self.stages[name] = {"calls": 0, "seconds": 0.0, "max_rss_kb": 0}
+
+        self.stages[name]["calls"] += 1
+        depth = self.active.get(name, 0)
+        self.active[name] = depth + 1
+
+        return None if depth else time.perf_counter()
+
+    def exit(self, name, start):
+        """
+        Marks the end of a call to a stage. Only
+        the outermost call of a recursive stage is
+        timed, so time is never counted twice.
+
+        :param name: stage name
+        :param start: what enter returned
+        """
+        self.active[name] -= 1
+
+        if start is not None:
+            stage = self.stages[name]
+            stage["seconds"] += time.perf_counter() - start
+            stage["max_rss_kb"] = max(stage["max_rss_kb"], max_rss_kb())
+
+    def count(self, name, n=1):
+        """
+        Adds to a counter.
+
+        :param name: counter name
+        :param n: amount to add
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        """
+        Records a value of a quantity.
+
+        :param name: quantity name
+        :param value: the value
+        """
+        if name not in self.observations:
+            self.observations[name] = {"count": 0, "total": 0, "min": value, "max": value}
+
+        entry = self.observations[name]
+        entry["count"] += 1
+        entry["total"] += value
+        entry["min"] = min(entry["min"], value)
+        entry["max"] = max(entry["max"], value)
+
+    def report(self):
+        """
+        :return: table of everything recorded
+        """
+        observations = {}
+
+        for name, entry in self.observations.items():
+            observations[name] = dict(entry, mean=entry["total"] / entry["count"])
+
+        return {
+            "stages": self.stages,
+            "counters": self.counters,
+            "observations": observations,
+            "max_rss_kb": max_rss_kb(),
+        }
+
+
+def max_rss_kb():
+    """
+    :return: the process's memory high-water mark
+             in KB, or 0 where it is unavailable
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else 0
+
+
+PROFILER = Profiler()
+
+
+def enable():
+    """
+    Starts recording.
+    """
+    PROFILER.reset()
+    PROFILER.enabled = True
+
+
+def disable():
+    """
+    Stops recording.
+    """
+    PROFILER.enabled = False
+
+
+def dump(path):
+    """
+    Writes everything recorded as JSON.
+
+    :param path: output file
+    """
+    with open(path, "w") as f:
+        json.dump(PROFILER.report(), f, indent=2)
+
+
+def profiled(name):
+    """
+    Decorates a function as a stage. While the
+    profiler is disabled the only cost is one
+    attribute check per call.
+
+    :param name: stage name
+    :return: the decorator
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return fn(*args, **kwargs)
+
+            start = PROFILER.enter(name)
+
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                PROFILER.exit(name, start)
+
+        return wrapper
+
+    return decorate
+
+
+class Stage:
+    """
+    Times a block of code as a stage:
+
+        with Stage("name"):
+            ...
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if PROFILER.enabled:
+            self.start = PROFILER.enter(self.name)
+            self.entered = True
+        else:
+            self.entered = False
+
+        return self
+
+    def __exit__(self, *exc):
+        if self.entered:
+            PROFILER.exit(self.name, self.start)
+
+        return False
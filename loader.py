@@ -0,0 +1,118 @@
+import os
+import pickle
+
+import d_model
+import ada_model
+import model_file
+from instance import FEATURE_VERSION
+from parse import Corpora
+
+# loaded models, keyed by path, size and modification time
+MODELS = {}
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    """
+    Unpickles models saved by older versions,
+    including ones pickled from a script run
+    as __main__.
+    """
+    modules = {
+        "DecisionModel": "d_model",
+        "AdaModel": "ada_model",
+        "DNode": "d_tree",
+        "Instance": "instance",
+        "WeightedSample": "weighted_sample",
+    }
+
+    def find_class(self, module, name):
+        if module == "__main__" and name in self.modules:
+            module = self.modules[name]
+
+        return super().find_class(module, name)
+
+
+def load_model(h_file):
+    """
+    Loads a model file. Pickled models from
+    older versions are still accepted.
+
+    :param h_file: model file
+    :return: the model
+    """
+    if not model_file.is_model_file(h_file):
+        f = open(h_file, "rb")
+        model = LegacyUnpickler(f).load()
+        f.close()
+
+        # the corpora pickled with the model are never used to predict
+        model.data = Corpora()
+
+        return model
+
+    kind, trees = model_file.read(h_file)
+
+    if kind == "dt":
+        return d_model.from_compiled(trees[0], h_file)
+
+    return ada_model.from_compiled(trees, h_file)
+
+
+def convert(h_file, out_file):
+    """
+    Converts a pickled model to a model file.
+
+    :param h_file: pickled model
+    :param out_file: output file
+    """
+    model = load_model(h_file)
+    model.save(out_file)
+
+
+def cached_model(h_file):
+    """
+    Loads a model file once, and again only
+    after it changes.
+
+    :param h_file: model file
+    :return: the model
+    """
+    stat = os.stat(h_file)
+    key = (os.path.abspath(h_file), stat.st_size, stat.st_mtime_ns)
+
+    if key not in MODELS:
+        MODELS[key] = load_model(h_file)
+
+    return MODELS[key]
+
+
+def discover(directory):
+    """
+    Lists the model files in a directory from
+    their headers, without loading any model.
+    Files from a different feature-set version
+    are left out.
+
+    :param directory: directory to search
+    :return: descriptions of the model files, most
+             accurate first, then newest first
+    """
+    found = []
+
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+
+        try:
+            if not os.path.isfile(path) or not model_file.is_model_file(path):
+                continue
+
+            manifest = model_file.describe(path)
+        except (IOError, ValueError):
+            continue
+
+        if manifest["feature_version"] in (None, FEATURE_VERSION):
+            found.append(manifest)
+
+    found.sort(key=lambda m: (m["accuracy"] if m["accuracy"] is not None else -1, m["mtime_ns"]), reverse=True)
+
+    return found
@@ -0,0 +1,226 @@
+import json
+import random
+
+import corpus_index
+from parse import CorpusReader, SHARD_SIZE
+
+
+class Evaluator:
+    """
+    This class scores predictions as they
+    stream in. It keeps a confusion matrix of
+    expected -> predicted -> count, from which
+    accuracy and the precision and recall of
+    every classification follow, and a random
+    sample of at most max_mistakes misclassified
+    lines. Memory does not grow with the number
+    of predictions.
+    """
+
+    def __init__(self, max_mistakes=10, seed=0):
+        """
+        Initialize empty metrics.
+
+        :param max_mistakes: misclassified lines to keep, 0 for none
+        :param seed: random seed of the sample
+        """
+        self.max_mistakes = max_mistakes
+        self.rng = random.Random(seed)
+        self.confusion = {}
+        self.total = 0
+        self.correct = 0
+        self.wrong = 0
+        self.mistakes = []
+
+    def add(self, value, result, goal):
+        """
+        Records a prediction.
+
+        :param value: the line, or None
+        :param result: predicted classification
+        :param goal: expected classification
+        """
+        row = self.confusion.get(goal)
+
+        if row is None:
+            row = self.confusion[goal] = {}
+
+        row[result] = row.get(result, 0) + 1
+        self.total += 1
+
+        if result == goal:
+            self.correct += 1
+            return
+
+        self.wrong += 1
+
+        # reservoir sampling keeps every mistake equally likely to be kept
+        if len(self.mistakes) < self.max_mistakes:
+            self.mistakes.append((value, result, goal))
+        else:
+            j = self.rng.randrange(self.wrong)
+
+            if j < self.max_mistakes:
+                self.mistakes[j] = (value, result, goal)
+
+    def add_block(self, values, results, goals):
+        """
+        Records the predictions of a block of rows.
+
+        :param values: the lines, or None
+        :param results: predicted classifications
+        :param goals: expected classifications
+        """
+        if values is None:
+            values = [None] * len(results)
+
+        for value, result, goal in zip(values, results, goals):
+            self.add(value, result, goal)
+
+    def accuracy(self):
+        """
+        :return: share of correct predictions, or None if there are none
+        """
+        return self.correct / self.total if self.total else None
+
+    def labels(self):
+        """
+        :return: sorted list of every classification
+                 expected or predicted
+        """
+        labels = set(self.confusion)
+
+        for row in self.confusion.values():
+            labels.update(row)
+
+        return sorted(labels, key=lambda label: (label is None, label or ""))
+
+    def precision(self, label):
+        """
+        :param label: a classification
+        :return: share of the predictions of label that
+                 were right, or None if it was never predicted
+        """
+        predicted = sum(row.get(label, 0) for row in self.confusion.values())
+
+        return self.confusion.get(label, {}).get(label, 0) / predicted if predicted else None
+
+    def recall(self, label):
+        """
+        :param label: a classification
+        :return: share of the rows of label predicted
+                 as label, or None if it was never expected
+        """
+        expected = sum(self.confusion.get(label, {}).values())
+
+        return self.confusion[label].get(label, 0) / expected if expected else None
+
+    def report(self):
+        """
+        :return: JSON form of the metrics
+        """
+        labels = self.labels()
+
+        return {
+            "total": self.total,
+            "correct": self.correct,
+            "accuracy": self.accuracy(),
+            "labels": labels,
+            "confusion": [[self.confusion.get(goal, {}).get(result, 0) for result in labels] for goal in labels],
+            "classes": {str(label): {"precision": self.precision(label), "recall": self.recall(label),
+                                     "support": sum(self.confusion.get(label, {}).values())}
+                        for label in labels},
+            "mistakes": [{"value": value, "result": result, "expected": goal}
+                         for value, result, goal in self.mistakes],
+        }
+
+    def write(self, path):
+        """
+        Writes the metrics as JSON.
+
+        :param path: output file
+        """
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def summary(self):
+        """
+        Prints the metrics of every classification,
+        the sample of mistakes and the accuracy.
+        """
+        print()
+
+        for label in self.labels():
+            precision = self.precision(label)
+            recall = self.recall(label)
+            print("| class:", label,
+                  "| precision:", "-" if precision is None else "%.4f" % precision,
+                  "| recall:", "-" if recall is None else "%.4f" % recall,
+                  "| support:", sum(self.confusion.get(label, {}).values()))
+
+        for value, result, goal in self.mistakes:
+            print("| oops! | value:", (value or "")[:50], "| result:", result, "| expected:", goal)
+
+        print()
+
+        if self.total:
+            print(str(self.accuracy() * 100) + "%", "accuracy")
+        else:
+            print("| no labeled lines")
+
+
+def evaluate(model, test_file=None, workers=1, shard_size=SHARD_SIZE, rows=None, mistakes=10, report=None):
+    """
+    Tests a trained model block by block,
+    printing the precision and recall of every
+    classification, a sample of misclassified
+    lines and the accuracy.
+
+    :param model: a DecisionModel or AdaModel
+    :param test_file: test data, or None for the model's own
+    :param workers: feature extraction processes
+    :param shard_size: bytes per extraction task
+    :param rows: line numbers of the test data to test on,
+                 read through its line index; None for all
+    :param mistakes: misclassified lines to print
+    :param report: file to write the metrics to as JSON, or None
+    :return: the metrics
+    """
+    reader = None
+
+    if test_file and rows is not None:
+        blocks = [corpus_index.load(test_file).matrix(rows, model.codebook())]
+    elif test_file:
+        reader = CorpusReader([test_file], workers=workers, shard_size=shard_size)
+        blocks = reader.blocks(model.codebook())
+    else:
+        blocks = [model.data["test"]]
+
+    metrics = Evaluator(mistakes)
+
+    for b in blocks:
+        metrics.add_block(b.values, model.predict_block(b), [b.goal(i) for i in range(b.size())])
+
+    metrics.summary()
+
+    if reader:
+        print(reader.report())
+
+    if report:
+        metrics.write(report)
+
+    return metrics
+
+
+def score(model, matrix):
+    """
+    :param model: a DecisionModel or AdaModel
+    :param matrix: feature matrix of labeled rows
+    :return: accuracy on the rows, or None if there are none
+    """
+    if not matrix.size():
+        return None
+
+    predicted = model.predict_block(matrix)
+
+    return sum(1 for i, label in enumerate(predicted) if label == matrix.goal(i)) / matrix.size()
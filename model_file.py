@@ -0,0 +1,251 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from compiled_tree import CompiledTree
+from feature_matrix import Codebook
+from instance import FEATURE_VERSION
+from ngrams import NgramHasher
+
+MAGIC = b"LCMODEL\0"
+VERSION = 1
+HEADER = struct.Struct("<8sHI")
+ALIGN = 8
+
+# (attribute, typecode) of every array of a compiled tree, in file order
+FIELDS = (("features", "h"), ("labels", "h"), ("offsets", "i"), ("widths", "H"), ("children", "i"))
+
+
+def is_model_file(path):
+    """
+    :param path: a file
+    :return: True if the file is in this format
+    """
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write(path, kind, trees, weights=None, accuracy=None):
+    """
+    Writes compiled trees to a model file. The
+    trees must share one codebook. The file is
+    written beside the path and moved into place,
+    so a model memory-mapped from the path keeps
+    its data.
+
+    :param path: output file
+    :param kind: "dt" or "ada"
+    :param trees: list of compiled trees
+    :param weights: sample weights to save after the
+                    trees, so boosting can be resumed
+    :param accuracy: accuracy on the test data, if known
+    """
+    codebook = trees[0].codebook
+    meta = {
+        "kind": kind,
+        "feature_version": FEATURE_VERSION,
+        "accuracy": accuracy,
+        "byteorder": sys.byteorder,
+        "codebook": {
+            "names": codebook.names,
+            "values": codebook.values,
+            "classes": codebook.classes,
+            "ngrams": codebook.hasher.config() if codebook.hasher else None,
+        },
+        "trees": [tree_info(tree) for tree in trees],
+    }
+
+    if weights is not None:
+        meta["weights"] = len(weights)
+
+    meta = json.dumps(meta).encode()
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(meta)))
+        f.write(meta)
+        pad(f)
+
+        for tree in trees:
+            for name, typecode in FIELDS:
+                f.write(array(typecode, getattr(tree, name)).tobytes())
+                pad(f)
+
+        if weights is not None:
+            f.write(array("d", weights).tobytes())
+
+    os.replace(path + ".tmp", path)
+
+
+def tree_info(tree):
+    """
+    :param tree: compiled tree
+    :return: JSON form of the tree's sizes, weight, maximum
+             depth and, if known, the class counts of its
+             leaves, as [leaf, [count of every class code]] pairs
+    """
+    info = {"nodes": tree.size(), "children": len(tree.children), "weight": tree.weight}
+
+    if tree.max_depth is not None:
+        info["max_depth"] = tree.max_depth
+
+    if tree.counts:
+        classes = len(tree.codebook.classes)
+        info["counts"] = [[node, [count.get(code, 0) for code in range(classes)]]
+                          for node, count in sorted(tree.counts.items())]
+
+    return info
+
+
+def pad(f):
+    """
+    Pads a file being written to the
+    next multiple of ALIGN bytes.
+
+    :param f: the file
+    """
+    f.write(b"\0" * (-f.tell() % ALIGN))
+
+
+def read_meta(path):
+    """
+    Reads the metadata of a model file without
+    touching its arrays.
+
+    :param path: model file
+    :return: (metadata, offset of the first array)
+    """
+    with open(path, "rb") as f:
+        magic, version, size = HEADER.unpack(f.read(HEADER.size))
+
+        if magic != MAGIC:
+            raise ValueError(path + " is not a model file")
+        if version > VERSION:
+            raise ValueError(path + " has unsupported version " + str(version))
+
+        meta = json.loads(f.read(size).decode())
+
+    offset = HEADER.size + size
+
+    return meta, offset + (-offset % ALIGN)
+
+
+def describe(path):
+    """
+    Describes a model file from its header alone.
+
+    :param path: model file
+    :return: table of the model's kind, feature-set
+             version, test accuracy, tree count, node
+             count and file size
+    """
+    meta, _ = read_meta(path)
+    stat = os.stat(path)
+
+    return {
+        "path": path,
+        "kind": meta["kind"],
+        "feature_version": meta.get("feature_version"),
+        "accuracy": meta.get("accuracy"),
+        "trees": len(meta["trees"]),
+        "nodes": sum(info["nodes"] for info in meta["trees"]),
+        "bytes": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def read(path):
+    """
+    Reads compiled trees from a model file. The
+    arrays are memory-mapped, not copied.
+
+    :param path: model file
+    :return: kind and list of compiled trees
+    """
+    meta, offset = read_meta(path)
+    codebook = decode_codebook(meta["codebook"])
+    swap = meta["byteorder"] != sys.byteorder
+
+    with open(path, "rb") as f:
+        view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    trees = []
+
+    for info in meta["trees"]:
+        tree = CompiledTree(codebook)
+        tree.weight = info["weight"]
+        tree.max_depth = info.get("max_depth")
+
+        if "counts" in info:
+            tree.counts = {node: {code: n for code, n in enumerate(counts) if n} for node, counts in info["counts"]}
+
+        for name, typecode in FIELDS:
+            count = info["children"] if name == "children" else info["nodes"]
+            size = count * array(typecode).itemsize
+            data = view[offset:offset + size].cast(typecode)
+
+            if swap:
+                data = array(typecode, data)
+                data.byteswap()
+
+            setattr(tree, name, data)
+            offset += size + (-size % ALIGN)
+
+        trees.append(tree)
+
+    return meta["kind"], trees
+
+
+def read_weights(path):
+    """
+    Reads the sample weights saved after the
+    trees of a model file.
+
+    :param path: model file
+    :return: array of weights, or None if none were saved
+    """
+    meta, offset = read_meta(path)
+
+    if "weights" not in meta:
+        return None
+
+    for info in meta["trees"]:
+        for name, typecode in FIELDS:
+            count = info["children"] if name == "children" else info["nodes"]
+            size = count * array(typecode).itemsize
+            offset += size + (-size % ALIGN)
+
+    weights = array("d")
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        weights.frombytes(f.read(meta["weights"] * weights.itemsize))
+
+    if meta["byteorder"] != sys.byteorder:
+        weights.byteswap()
+
+    return weights
+
+
+def decode_codebook(table):
+    """
+    Rebuilds a codebook from its JSON form.
+    JSON turns tuples into lists, so lists are
+    turned back into tuples.
+
+    :param table: the codebook's JSON form
+    :return: the codebook
+    """
+    ngrams = table.get("ngrams")
+    codebook = Codebook(table["names"], NgramHasher(**ngrams) if ngrams else None)
+
+    for column, values in enumerate(table["values"]):
+        for value in values:
+            codebook.encode(column, tuple(value) if isinstance(value, list) else value)
+
+    for goal in table["classes"]:
+        codebook.encode_goal(goal)
+
+    return codebook
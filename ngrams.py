@@ -0,0 +1,172 @@
+from array import array
+from zlib import crc32
+
+# prefix of the names of n-gram bucket features
+PREFIX = "ngram_"
+
+
+class NgramHasher:
+    """
+    This class hashes the character n-grams of a
+    line into a fixed number of buckets. Each
+    bucket is a binary feature: does the line
+    hold an n-gram that hashes into it? Hashing
+    is stable across processes and runs.
+    """
+
+    def __init__(self, buckets=4096, sizes=(1, 2, 3)):
+        """
+        Initialize the hasher.
+
+        :param buckets: number of hash buckets, at most 65536
+        :param sizes: n-gram lengths
+        """
+        if not 0 < buckets <= 1 << 16:
+            raise ValueError("buckets must be between 1 and 65536")
+
+        self.buckets = buckets
+        self.sizes = tuple(sizes)
+
+    def vector(self, text):
+        """
+        Counts the n-grams of a text per bucket.
+        The text is lower-cased, its whitespace
+        collapsed and padded with a space.
+
+        :param text: the text
+        :return: sorted list of buckets and list of their counts
+        """
+        text = " " + " ".join(text.lower().split()) + " "
+        buckets = self.buckets
+        counts = {}
+
+        for n in self.sizes:
+            for i in range(len(text) - n + 1):
+                bucket = crc32(text[i:i + n].encode()) % buckets
+                counts[bucket] = counts.get(bucket, 0) + 1
+
+        indices = sorted(counts)
+
+        return indices, [min(counts[bucket], 0xFFFF) for bucket in indices]
+
+    def name(self, bucket):
+        """
+        :param bucket: a bucket
+        :return: feature name of the bucket
+        """
+        return PREFIX + str(bucket)
+
+    def bucket(self, name):
+        """
+        :param name: a feature name
+        :return: the bucket it names, or None
+        """
+        if not name.startswith(PREFIX):
+            return None
+
+        bucket = int(name[len(PREFIX):])
+
+        return bucket if bucket < self.buckets else None
+
+    def names(self):
+        """
+        :return: set of every bucket's feature name
+        """
+        return {self.name(bucket) for bucket in range(self.buckets)}
+
+    def config(self):
+        """
+        :return: JSON form of the hasher
+        """
+        return {"buckets": self.buckets, "sizes": list(self.sizes)}
+
+    def __eq__(self, other):
+        return isinstance(other, NgramHasher) and self.config() == other.config()
+
+    def __repr__(self):
+        return "NgramHasher(" + str(self.buckets) + ", " + str(self.sizes) + ")"
+
+
+class SparseRows:
+    """
+    This class holds the n-gram counts of many
+    rows in compressed sparse row form: the
+    buckets and counts of row i are
+    indices[indptr[i]:indptr[i + 1]] and
+    counts[indptr[i]:indptr[i + 1]].
+    """
+
+    def __init__(self):
+        """
+        Initialize with no rows.
+        """
+        self.indptr = array("L", [0])
+        self.indices = array("H")
+        self.counts = array("H")
+
+    def add(self, indices, counts):
+        """
+        Adds a row.
+
+        :param indices: sorted buckets of the row
+        :param counts: count of every bucket
+        """
+        self.indices.extend(indices)
+        self.counts.extend(counts)
+        self.indptr.append(len(self.indices))
+
+    def extend(self, other):
+        """
+        Appends the rows of another SparseRows.
+
+        :param other: the rows to append
+        """
+        base = self.indptr[-1]
+
+        self.indices.extend(other.indices)
+        self.counts.extend(other.counts)
+        self.indptr.extend(array("L", [base + end for end in other.indptr[1:]]))
+
+    def row(self, i):
+        """
+        :param i: row index
+        :return: buckets and counts of row i
+        """
+        start, end = self.indptr[i], self.indptr[i + 1]
+
+        return self.indices[start:end], self.counts[start:end]
+
+    def presence(self, bucket, start, end):
+        """
+        :param bucket: a bucket
+        :param start: first row
+        :param end: row after the last
+        :return: array with 1 for every row holding
+                 the bucket, 0 for every other row
+        """
+        indptr = self.indptr
+        indices = self.indices
+        result = array("B", bytes(end - start))
+
+        for i in range(start, end):
+            first, last = indptr[i], indptr[i + 1]
+
+            # buckets are sorted within a row
+            while first < last:
+                middle = (first + last) // 2
+
+                if indices[middle] < bucket:
+                    first = middle + 1
+                else:
+                    last = middle
+
+            if first < indptr[i + 1] and indices[first] == bucket:
+                result[i - start] = 1
+
+        return result
+
+    def size(self):
+        """
+        :return: number of rows
+        """
+        return len(self.indptr) - 1
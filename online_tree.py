@@ -0,0 +1,284 @@
+import math
+
+from d_tree import DNode, counts_entropy, vote
+from instrument import profiled
+
+
+def hoeffding_bound(value_range, delta, n):
+    """
+    With probability 1 - delta, the true mean of
+    a quantity is within this distance of the
+    mean of n observations of it.
+
+    :param value_range: range of the quantity
+    :param delta: allowed probability of error
+    :param n: number of observations
+    :return: the bound
+    """
+    return math.sqrt(value_range * value_range * math.log(1 / delta) / (2 * n))
+
+
+class LeafStats:
+    """
+    This class holds the sufficient statistics
+    of the examples that reached a leaf: the
+    count of every classification, overall and
+    for each value of each feature the leaf can
+    still split on. Class counts saved with the
+    tree weigh in on the leaf's label, but not
+    on its splits.
+    """
+
+    def __init__(self, features, depth, prior=None):
+        """
+        Initialize empty statistics.
+
+        :param features: set of feature names the leaf can split on
+        :param depth: depth of the leaf
+        :param prior: table of classification -> count of the
+                      examples that reached the leaf before, or None
+        """
+        self.features = features
+        self.depth = depth
+        self.prior = dict(prior) if prior else {}
+        self.n = 0
+        self.pending = 0
+        self.count = {}
+        self.tables = {feature: {} for feature in features}
+
+    def add(self, goal, values):
+        """
+        Counts an example.
+
+        :param goal: the example's classification
+        :param values: table of feature -> value
+        """
+        self.n += 1
+        self.pending += 1
+        self.count[goal] = self.count.get(goal, 0) + 1
+
+        for feature in self.features:
+            table = self.tables[feature]
+            value = values[feature]
+
+            if value in table:
+                count = table[value]
+                count[goal] = count.get(goal, 0) + 1
+            else:
+                table[value] = {goal: 1}
+
+    def totals(self):
+        """
+        :return: table of classification -> count, prior
+                 examples included
+        """
+        totals = dict(self.prior)
+
+        for goal, n in self.count.items():
+            totals[goal] = totals.get(goal, 0) + n
+
+        return totals
+
+    def plurality(self):
+        """
+        :return: the most common classification
+        """
+        totals = self.totals()
+
+        return max(totals, key=totals.get) if totals else None
+
+    def gains(self):
+        """
+        :return: list of (gain, feature), best first
+        """
+        entrpy = counts_entropy(self.count.values(), self.n)
+        result = []
+
+        for feature in self.features:
+            total = 0
+
+            for count in self.tables[feature].values():
+                size = sum(count.values())
+                total += (size/self.n) * counts_entropy(count.values(), size)
+
+            result.append((entrpy - total, feature))
+
+        result.sort(key=lambda entry: entry[0], reverse=True)
+
+        return result
+
+
+class OnlineTree:
+    """
+    This class grows an existing decision tree
+    as labeled examples stream in, in the manner
+    of a Hoeffding tree. Every leaf keeps the
+    statistics of the examples that reached it
+    since the tree was wrapped, on top of the
+    class counts saved with it. Every grace
+    examples, a leaf relabels itself with its
+    most common classification and splits on its
+    best feature once the Hoeffding bound shows,
+    with probability 1 - delta, that the feature
+    is better than the runner-up (or the two tie
+    within tie). The cost of an update depends
+    only on the new examples.
+    """
+
+    def __init__(self, root, features, depth=7, grace=200, delta=1e-7, tie=0.05, priors=True):
+        """
+        Wrap a tree.
+
+        :param root: root DNode of the tree
+        :param features: set of feature names
+        :param depth: maximum depth
+        :param grace: examples a leaf sees between split attempts
+        :param delta: allowed probability of a wrong split
+        :param tie: bound below which the best features are tied
+        :param priors: start the leaves with their saved class counts?
+        """
+        self.root = root
+        self.features = features
+        self.depth = depth
+        self.priors = priors
+        self.grace = grace
+        self.delta = delta
+        self.tie = tie
+        self.stats = {}
+        self.splits = 0
+        self.relabels = 0
+
+    def leaf(self, values):
+        """
+        Finds the leaf an example reaches. A value
+        an internal node has never seen gets a new
+        leaf, labeled with the node's vote.
+
+        :param values: table of feature -> value
+        :return: the leaf and its statistics
+        """
+        node = self.root
+        used = []
+
+        while not node.is_leaf:
+            value = values[node.value]
+            used.append(node.value)
+
+            if value not in node.children:
+                node.add(value, DNode(vote(node), is_leaf=True))
+
+            node = node.children[value]
+
+        stats = self.stats.get(node)
+
+        if stats is None:
+            stats = self.stats[node] = LeafStats(self.features.difference(used), len(used),
+                                                 node.counts if self.priors else None)
+
+        return node, stats
+
+    @profiled("online_observe")
+    def observe(self, matrix, grow=True):
+        """
+        Counts every labeled row of a feature
+        matrix at the leaf it reaches.
+
+        :param matrix: feature matrix
+        :param grow: relabel and split leaves?
+        :return: True if the tree changed
+        """
+        codebook = matrix.codebook
+        names = [name for name in codebook.names if name in self.features]
+        columns = [(name, codebook.index[name], matrix.column(name)) for name in names]
+        changed = False
+
+        for i in range(matrix.size()):
+            goal = matrix.goal(i)
+
+            if goal is None:
+                continue
+
+            values = {name: codebook.values[column][codes[i]] for name, column, codes in columns}
+            node, stats = self.leaf(values)
+            stats.add(goal, values)
+
+            if grow and stats.pending >= self.grace:
+                stats.pending = 0
+                changed = self.attempt(node, stats) or changed
+
+        return changed
+
+    def attempt(self, node, stats):
+        """
+        Relabels a leaf with its most common
+        classification and splits it if the
+        Hoeffding bound allows.
+
+        :param node: the leaf
+        :param stats: the leaf's statistics
+        :return: True if the leaf changed
+        """
+        changed = False
+        plurality = stats.plurality()
+
+        if plurality != node.value:
+            node.value = plurality
+            self.relabels += 1
+            changed = True
+
+        if len(stats.count) < 2 or not stats.features or stats.depth >= self.depth:
+            return changed
+
+        gains = stats.gains()
+        best, feature = gains[0]
+        second = gains[1][0] if len(gains) > 1 else 0
+        bound = hoeffding_bound(math.log(max(len(stats.count), 2), 2), self.delta, stats.n)
+
+        if best > 0 and (best - second > bound or bound < self.tie):
+            self.split(node, stats, feature)
+            changed = True
+
+        return changed
+
+    def split(self, node, stats, feature):
+        """
+        Turns a leaf into an internal node with a
+        leaf for every value of a feature.
+
+        :param node: the leaf
+        :param stats: the leaf's statistics
+        :param feature: feature to split on
+        """
+        del self.stats[node]
+
+        node.is_leaf = False
+        node.value = feature
+        node.counts = None
+        features = stats.features.difference({feature})
+
+        for value, count in stats.tables[feature].items():
+            child = DNode(max(count, key=count.get), is_leaf=True)
+            self.stats[child] = LeafStats(features, stats.depth + 1)
+            node.add(value, child)
+
+        self.splits += 1
+
+    def record(self):
+        """
+        Stores the class counts of every leaf
+        with statistics on the leaf, and the
+        maximum depth on the root, to be saved
+        with the tree.
+        """
+        self.root.max_depth = self.depth
+
+        for node, stats in self.stats.items():
+            if node.is_leaf:
+                node.counts = stats.totals() or None
+
+    def report(self):
+        """
+        :return: summary of the updates so far
+        """
+        return "| active leaves: " + str(len(self.stats)) + " | splits: " + str(self.splits) + \
+               " | relabels: " + str(self.relabels)
@@ -1,22 +1,346 @@
+import os
+import time
+from collections.abc import Mapping
+from multiprocessing import Pool
+
 from instance import Instance
+from instrument import profiled
+from feature_matrix import Codebook, FeatureMatrix
+
+CHUNK_SIZE = 10000
+SHARD_SIZE = 1 << 20
 
 
-def parse(files):
+@profiled("parse")
+def parse(files, keep_text=False):
     """
     Parses instances from a file
 
     :param files: a collection of files
+    :param keep_text: keep the text of every line?
     :return: a collection of instances
     """
     lines = [[] for _ in files]
 
     for i in range(len(files)):
-        filename = files[i]
-
-        for line in open(filename):
-            if not len(line.strip()) > 3:
-                continue
+        reader = CorpusReader([files[i]])
 
-            lines[i].append(Instance(line))
+        for chunk in reader.instances(keep_text):
+            lines[i].extend(chunk)
 
     return lines
+
+
+@profiled("parse_matrix")
+def parse_matrix(files, codebook=None, keep_text=True, workers=1, shard_size=SHARD_SIZE, store=None):
+    """
+    Parses a feature matrix from each file. The
+    matrices share a single codebook.
+
+    :param files: a collection of files
+    :param codebook: codebook to extend
+    :param keep_text: keep the text of every line?
+    :param workers: number of worker processes
+    :param shard_size: bytes per worker task
+    :param store: feature store to reuse matrices from
+    :return: a collection of feature matrices
+    """
+    codebook = codebook if codebook else Codebook()
+    matrices = []
+
+    for filename in files:
+        matrix = FeatureMatrix(codebook, keep_text)
+        stored = store.load(filename, keep_text, codebook.hasher) if store else None
+
+        if stored is not None:
+            matrix.merge(stored)
+        else:
+            reader = CorpusReader([filename], workers=workers, shard_size=shard_size)
+
+            for block in reader.blocks(codebook, keep_text):
+                matrix.merge(block)
+
+            if store:
+                store.save(filename, matrix, keep_text, codebook.hasher)
+
+        matrices.append(matrix)
+
+    return matrices
+
+
+class Corpora(Mapping):
+    """
+    This class holds a model's training and test
+    data as a table of "train" and "test" ->
+    feature matrix. A corpus is parsed the first
+    time it is looked up, so a model built only
+    to predict never reads its corpora. The test
+    data shares the training data's codebook.
+    A matrix can also be set directly. Pickling
+    keeps the file names, not the matrices.
+    """
+
+    def __init__(self, train_file=None, test_file=None, ngrams=None, workers=1, shard_size=SHARD_SIZE, store=None):
+        """
+        Initialize without parsing anything.
+
+        :param train_file: training data, or None
+        :param test_file: test data, or None
+        :param ngrams: NgramHasher adding n-gram features, or None
+        :param workers: feature extraction processes
+        :param shard_size: bytes per extraction task
+        :param store: feature store to reuse features from
+        """
+        self.files = {name: filename for name, filename in (("train", train_file), ("test", test_file)) if filename}
+        self.ngrams = ngrams
+        self.workers = workers
+        self.shard_size = shard_size
+        self.store = store
+        self.loaded = {}
+
+    def __getitem__(self, name):
+        if name not in self.loaded:
+            if name not in self.files:
+                raise KeyError(name)
+
+            if name == "train":
+                codebook, keep_text = Codebook(hasher=self.ngrams), False
+            else:
+                codebook, keep_text = self["train"].codebook if "train" in self else None, True
+
+            self.loaded[name] = parse_matrix([self.files[name]], codebook, keep_text, workers=self.workers,
+                                             shard_size=self.shard_size, store=self.store)[0]
+
+        return self.loaded[name]
+
+    def __setitem__(self, name, matrix):
+        self.loaded[name] = matrix
+
+    def __iter__(self):
+        return iter(list(self.files) + [name for name in self.loaded if name not in self.files])
+
+    def __len__(self):
+        return len(set(self.files).union(self.loaded))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["loaded"] = {}
+
+        return state
+
+
+def raw_lines(source):
+    """
+    Splits binary data into lines the way a
+    text-mode open() does: on "\\n", "\\r\\n" and a
+    lone "\\r". Every reader of a corpus splits
+    lines with this, so they all agree on what a
+    line is.
+
+    :param source: iterable of bytes, such as a binary file
+    :return: generator of raw lines, with their line endings
+    """
+    for data in source:
+        yield from data.splitlines(keepends=True)
+
+
+def decode_line(raw):
+    """
+    Decodes a raw line, translating its line
+    ending to "\\n".
+
+    :param raw: line as bytes
+    :return: the line, or None if it is too
+             short to hold a label and some data
+    """
+    line = raw.decode()
+
+    if line.endswith("\r\n"):
+        line = line[:-2] + "\n"
+    elif line.endswith("\r"):
+        line = line[:-1] + "\n"
+
+    if not len(line.strip()) > 3:
+        return None
+
+    return line
+
+
+def shard_ranges(filename, shard_size=SHARD_SIZE):
+    """
+    Splits a file into byte ranges of about
+    shard_size bytes which start and end on
+    line boundaries.
+
+    :param filename: the file
+    :param shard_size: bytes per range
+    :return: list of (start, end) offsets
+    """
+    ranges = []
+    size = os.path.getsize(filename)
+    start = 0
+
+    with open(filename, "rb") as f:
+        while start < size:
+            f.seek(min(start + shard_size, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+
+    return ranges
+
+
+def extract_shard(task):
+    """
+    Extracts a feature matrix from a byte range
+    of a file. Runs in a worker process.
+
+    :param task: (filename, start, end, keep_text, hasher)
+    :return: (matrix, bytes read, lines read, lines skipped)
+    """
+    filename, start, end, keep_text, hasher = task
+    matrix = FeatureMatrix(Codebook(hasher=hasher), keep_text)
+    skipped = 0
+
+    with open(filename, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    for raw in raw_lines((data,)):
+        line = decode_line(raw)
+
+        if line is None:
+            skipped += 1
+        else:
+            matrix.append(line)
+
+    return matrix, len(data), matrix.size(), skipped
+
+
+class CorpusReader:
+    """
+    This class streams lines from a collection
+    of files in fixed-size chunks, so only one
+    chunk is held in memory at a time.
+    """
+
+    def __init__(self, files, chunk_size=CHUNK_SIZE, workers=1, shard_size=SHARD_SIZE):
+        """
+        Initialize the reader.
+
+        :param files: a collection of files
+        :param chunk_size: lines per chunk
+        :param workers: number of worker processes
+                        used to extract feature blocks
+        :param shard_size: bytes per worker task
+        """
+        self.files = files
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.shard_size = shard_size
+        self.bytes_read = 0
+        self.lines_read = 0
+        self.lines_skipped = 0
+        self.seconds = 0
+
+    def lines(self):
+        """
+        Yields every usable line. Lines too short
+        to hold a label and some data are skipped.
+
+        :return: generator of lines
+        """
+        for filename in self.files:
+            with open(filename, "rb") as f:
+                for raw in raw_lines(f):
+                    self.bytes_read += len(raw)
+                    line = decode_line(raw)
+
+                    if line is None:
+                        self.lines_skipped += 1
+                        continue
+
+                    self.lines_read += 1
+                    yield line
+
+    def chunks(self):
+        """
+        Yields lists of at most chunk_size lines.
+
+        :return: generator of line lists
+        """
+        chunk = []
+
+        for line in self.lines():
+            chunk.append(line)
+
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+    def instances(self, keep_text=False):
+        """
+        Yields lists of at most chunk_size instances.
+
+        :param keep_text: keep the text of every line?
+        :return: generator of instance lists
+        """
+        for chunk in self.chunks():
+            yield [Instance(line, keep_text=keep_text) for line in chunk]
+
+    def blocks(self, codebook=None, keep_text=True):
+        """
+        Yields feature matrices in file order. The
+        matrices share a single codebook. With more
+        than one worker, each matrix holds a shard
+        of about shard_size bytes extracted in a
+        worker process; otherwise each holds at
+        most chunk_size rows.
+
+        :param codebook: codebook to extend
+        :param keep_text: keep the text of every line?
+        :return: generator of feature matrices
+        """
+        codebook = codebook if codebook else Codebook()
+        start = time.time()
+
+        if self.workers > 1:
+            tasks = [(filename, first, last, keep_text, codebook.hasher)
+                     for filename in self.files
+                     for first, last in shard_ranges(filename, self.shard_size)]
+
+            with Pool(self.workers) as pool:
+                for shard, n_bytes, n_lines, n_skipped in pool.imap(extract_shard, tasks):
+                    matrix = FeatureMatrix(codebook, keep_text)
+                    matrix.merge(shard)
+
+                    self.bytes_read += n_bytes
+                    self.lines_read += n_lines
+                    self.lines_skipped += n_skipped
+                    self.seconds += time.time() - start
+
+                    yield matrix
+
+                    start = time.time()
+        else:
+            for chunk in self.chunks():
+                matrix = FeatureMatrix(codebook, keep_text)
+                matrix.extend(chunk)
+                self.seconds += time.time() - start
+
+                yield matrix
+
+                start = time.time()
+
+    def report(self):
+        """
+        :return: summary of what has been read
+        """
+        rate = self.lines_read / self.seconds if self.seconds else 0
+
+        return "| lines: " + str(self.lines_read) + " | skipped: " + str(self.lines_skipped) + \
+               " | bytes: " + str(self.bytes_read) + " | lines/sec: " + str(int(rate))
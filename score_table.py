@@ -0,0 +1,145 @@
+from compiled_tree import MISS
+from instrument import profiled
+
+
+class ScoreTable:
+    """
+    This class represents an ensemble of weighted
+    stumps folded into one additive table. A
+    stump on a feature adds its weight to the
+    score of the classification it gives each
+    value, so every stump on the same feature
+    folds into one score table per feature.
+    Classifying a row costs one lookup per
+    feature used, however many stumps there are.
+
+    Scores are kept per slot: slot k is the
+    classification with code k, and the last
+    slot is no classification.
+    """
+
+    def __init__(self, codebook):
+        """
+        Initialize an empty table.
+
+        :param codebook: codebook of the stumps' codes
+        """
+        self.codebook = codebook
+        self.slots = len(codebook.classes) + 1
+        self.bias = [0.0] * self.slots
+        self.tables = {}
+
+    def slot(self, label):
+        """
+        :param label: classification code, or -1 for none
+        :return: the score slot of the classification
+        """
+        return self.slots - 1 if label < 0 else label
+
+    def add(self, stump):
+        """
+        Folds a compiled stump into the table.
+
+        :param stump: a CompiledTree of depth 0 or 1
+        """
+        column = stump.features[0]
+        default = self.slot(stump.labels[0])
+
+        if column < 0:
+            self.bias[default] += stump.weight
+            return
+
+        if column not in self.tables:
+            self.tables[column] = [[0.0] * 256 for _ in range(self.slots)]
+
+        table = self.tables[column]
+        offset = stump.offsets[0]
+
+        for code in range(256):
+            child = stump.children[offset + code] if code < stump.widths[0] else -1
+
+            if child < 0:
+                slot = default
+            elif stump.features[child] >= 0:
+                raise ValueError("only trees of depth 1 can be folded")
+            else:
+                slot = self.slot(stump.labels[child])
+
+            table[slot][code] += stump.weight
+
+    @profiled("score_predict")
+    def predict(self, matrix):
+        """
+        Classifies every row of a feature matrix.
+
+        :param matrix: feature matrix
+        :return: list of classification codes, -1 for none
+        """
+        n = matrix.size()
+        scores = [[bias] * n for bias in self.bias]
+        other = matrix.codebook
+
+        for column, table in self.tables.items():
+            name = self.codebook.names[column]
+            codes = matrix.column(name)
+
+            if other is not self.codebook:
+                known = self.codebook.codes[column]
+                translation = [known.get(value, MISS) for value in other.values[other.index[name]]]
+                codes = [translation[code] for code in codes]
+
+            for slot in range(self.slots):
+                lookup = table[slot]
+                scores[slot] = [s + lookup[code] for s, code in zip(scores[slot], codes)]
+
+        best = [0] * n
+        top = scores[0]
+
+        for slot in range(1, self.slots):
+            current = scores[slot]
+            best = [slot if s > t else b for s, t, b in zip(current, top, best)]
+            top = [s if s > t else t for s, t in zip(current, top)]
+
+        none = self.slots - 1
+
+        return [-1 if b == none else b for b in best]
+
+    def decide(self, instance):
+        """
+        Classify an instance of data.
+
+        :param instance: instance of data
+        :return: classification
+        """
+        codebook = self.codebook
+        scores = list(self.bias)
+
+        for column, table in self.tables.items():
+            code = codebook.codes[column].get(instance.features[codebook.names[column]], MISS)
+
+            for slot in range(self.slots):
+                scores[slot] += table[slot][code]
+
+        best = 0
+
+        for slot in range(1, self.slots):
+            if scores[slot] > scores[best]:
+                best = slot
+
+        return None if best == self.slots - 1 else codebook.classes[best]
+
+
+def fold(stumps):
+    """
+    Folds compiled stumps sharing one codebook
+    into a ScoreTable.
+
+    :param stumps: list of compiled stumps
+    :return: the score table
+    """
+    table = ScoreTable(stumps[0].codebook)
+
+    for stump in stumps:
+        table.add(stump)
+
+    return table
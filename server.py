@@ -0,0 +1,462 @@
+import http.client
+import json
+import os
+import queue
+import socket
+import socketserver
+import stat
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from feature_matrix import FeatureMatrix
+from feature_store import FeatureCache
+from loader import load_model
+
+# upper bounds, in ms, of the latency histogram buckets
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+def usable(line):
+    """
+    :param line: an input line
+    :return: True if the line is long enough to classify
+    """
+    return len(line.strip()) > 3
+
+
+class Pending:
+    """
+    This class represents a request waiting
+    for its lines to be classified.
+    """
+
+    def __init__(self, lines):
+        """
+        :param lines: lines to classify
+        """
+        self.lines = lines
+        self.labels = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """
+    This class coalesces concurrent requests into
+    micro-batches. A single thread owns the model:
+    it waits for a request, gathers whatever else
+    arrives within max_wait seconds (up to
+    max_batch lines) and classifies it all as one
+    feature matrix.
+    """
+
+    def __init__(self, model, metrics, max_batch=256, max_wait=0.002, cache=None):
+        """
+        Initialize the batcher and start its thread.
+
+        :param model: a DecisionModel or AdaModel
+        :param metrics: metrics to update
+        :param max_batch: most lines per micro-batch
+        :param max_wait: seconds to wait for more requests
+        :param cache: feature cache for repeated lines
+        """
+        self.model = model
+        self.metrics = metrics
+        self.cache = cache
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, lines):
+        """
+        Classifies lines, blocking until their
+        micro-batch is done.
+
+        :param lines: lines to classify
+        :return: list of classifications
+        """
+        pending = Pending(lines)
+        self.queue.put(pending)
+        pending.done.wait()
+
+        if pending.error:
+            raise pending.error
+
+        return pending.labels
+
+    def run(self):
+        """
+        Gathers and classifies micro-batches forever.
+        """
+        while True:
+            batch = [self.queue.get()]
+            size = len(batch[0].lines)
+            deadline = time.time() + self.max_wait
+
+            while size < self.max_batch:
+                timeout = deadline - time.time()
+
+                if timeout <= 0:
+                    break
+
+                try:
+                    pending = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+
+                batch.append(pending)
+                size += len(pending.lines)
+
+            self.classify(batch)
+
+    def classify(self, batch):
+        """
+        Classifies a micro-batch and wakes up
+        its requests. A request that fails fails
+        alone: its lines are featurized apart, and
+        if the batch cannot be classified as a
+        whole each request is classified by itself.
+
+        :param batch: list of pending requests
+        """
+        codebook = self.model.codebook()
+        matrix = FeatureMatrix(codebook, keep_text=False)
+        parts = []
+
+        for pending in batch:
+            try:
+                part = FeatureMatrix(codebook, keep_text=False)
+
+                for line in pending.lines:
+                    if usable(line):
+                        part.append(line, True, self.cache)
+
+                parts.append((pending, part))
+            except Exception as e:
+                pending.error = e
+
+        for _, part in parts:
+            matrix.merge(part)
+
+        try:
+            labels = iter(self.model.predict_block(matrix))
+
+            for pending, _ in parts:
+                pending.labels = [next(labels) if usable(line) else None for line in pending.lines]
+        except Exception:
+            for pending, part in parts:
+                try:
+                    labels = iter(self.model.predict_block(part))
+                    pending.labels = [next(labels) if usable(line) else None for line in pending.lines]
+                except Exception as e:
+                    pending.error = e
+
+        self.metrics.batch(matrix.size())
+
+        for pending in batch:
+            pending.done.set()
+
+
+class Metrics:
+    """
+    This class counts requests and keeps a
+    histogram of request latencies.
+    """
+
+    def __init__(self):
+        """
+        Initialize empty metrics.
+        """
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.lines = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_lines = 0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def request(self, lines, seconds, error=False):
+        """
+        Records a request.
+
+        :param lines: number of lines in the request
+        :param seconds: time taken by the request
+        :param error: did the request fail?
+        """
+        ms = seconds * 1000
+        bucket = 0
+
+        while bucket < len(BUCKETS) and ms > BUCKETS[bucket]:
+            bucket += 1
+
+        with self.lock:
+            self.requests += 1
+            self.lines += lines
+            self.errors += 1 if error else 0
+            self.histogram[bucket] += 1
+
+    def batch(self, lines):
+        """
+        Records a micro-batch.
+
+        :param lines: number of lines classified
+        """
+        with self.lock:
+            self.batches += 1
+            self.batched_lines += lines
+
+    def report(self):
+        """
+        :return: table of every metric
+        """
+        with self.lock:
+            buckets = ["<=" + str(ms) + "ms" for ms in BUCKETS] + [">" + str(BUCKETS[-1]) + "ms"]
+
+            return {
+                "requests": self.requests,
+                "lines": self.lines,
+                "errors": self.errors,
+                "batches": self.batches,
+                "lines_per_batch": self.batched_lines / self.batches if self.batches else 0,
+                "latency": dict(zip(buckets, self.histogram)),
+            }
+
+
+def request_lines(body):
+    """
+    Checks the body of a prediction request.
+
+    :param body: decoded JSON body
+    :return: the lines to classify, and True if
+             the request holds a single line
+    """
+    if not isinstance(body, dict):
+        raise ValueError("the body must be a JSON object")
+
+    if "line" in body:
+        if not isinstance(body["line"], str):
+            raise ValueError("\"line\" must be a string")
+
+        return [body["line"]], True
+
+    lines = body.get("lines")
+
+    if not isinstance(lines, list) or not all(isinstance(line, str) for line in lines):
+        raise ValueError("\"lines\" must be a list of strings")
+
+    return lines, False
+
+
+class PredictHandler(BaseHTTPRequestHandler):
+    """
+    Handles HTTP requests.
+
+     - POST /predict with {"line": ...} or
+       {"lines": [...]} answers {"label": ...}
+       or {"labels": [...]}.
+     - GET /stats answers the server's metrics.
+    """
+
+    def do_POST(self):
+        if self.path != "/predict":
+            return self.reply(404, {"error": "not found"})
+
+        start = time.time()
+        lines = []
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            lines, single = request_lines(body)
+            labels = self.server.batcher.submit(lines)
+        except Exception as e:
+            self.server.metrics.request(len(lines), time.time() - start, error=True)
+            return self.reply(400, {"error": str(e)})
+
+        self.server.metrics.request(len(lines), time.time() - start)
+        self.reply(200, {"label": labels[0]} if single else {"labels": labels})
+
+    def do_GET(self):
+        if self.path != "/stats":
+            return self.reply(404, {"error": "not found"})
+
+        report = self.server.metrics.report()
+        cache = self.server.batcher.cache
+
+        if cache is not None:
+            report["cache"] = cache.report()
+
+        self.reply(200, report)
+
+    def reply(self, status, table):
+        """
+        Sends a JSON response.
+
+        :param status: HTTP status
+        :param table: response body
+        """
+        body = json.dumps(table).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    An HTTP server listening on a Unix socket.
+    """
+    daemon_threads = True
+
+
+def make_server(model, port=8000, socket_path=None, max_batch=256, max_wait=0.002, cache_size=100000):
+    """
+    Builds a prediction server around a loaded
+    model. Call serve_forever() to run it.
+
+    :param model: a DecisionModel or AdaModel
+    :param port: localhost port to listen on
+    :param socket_path: Unix socket to listen on
+                        instead of a port
+    :param max_batch: most lines per micro-batch
+    :param max_wait: seconds to wait for more requests
+    :param cache_size: lines kept in the feature cache, 0 for none
+    :return: the server
+    """
+    if socket_path:
+        if os.path.exists(socket_path):
+            # only a stale socket is replaced
+            if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                raise ValueError(socket_path + " exists and is not a socket")
+
+            os.remove(socket_path)
+
+        server = UnixHTTPServer(socket_path, PredictHandler)
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", port), PredictHandler)
+        server.daemon_threads = True
+
+    server.metrics = Metrics()
+    cache = FeatureCache(cache_size) if cache_size else None
+    server.batcher = MicroBatcher(model, server.metrics, max_batch, max_wait, cache)
+
+    return server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    An HTTP connection over a Unix socket.
+    """
+
+    def __init__(self, socket_path):
+        super().__init__("localhost")
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+class Client:
+    """
+    A client for a local prediction server.
+    """
+
+    def __init__(self, port=8000, socket_path=None):
+        """
+        :param port: localhost port of the server
+        :param socket_path: Unix socket of the server
+        """
+        self.port = port
+        self.socket_path = socket_path
+
+    def call(self, method, path, table=None):
+        """
+        Sends a request and decodes the response.
+
+        :param method: HTTP method
+        :param path: request path
+        :param table: JSON body
+        :return: decoded response
+        """
+        if self.socket_path:
+            conn = UnixHTTPConnection(self.socket_path)
+        else:
+            conn = http.client.HTTPConnection("127.0.0.1", self.port)
+
+        body = json.dumps(table) if table is not None else None
+
+        try:
+            conn.request(method, path, body, {"Content-Type": "application/json"})
+            return json.loads(conn.getresponse().read())
+        finally:
+            conn.close()
+
+    def predict(self, line):
+        """
+        :param line: line to classify
+        :return: classification
+        """
+        return self.call("POST", "/predict", {"line": line})["label"]
+
+    def predict_lines(self, lines):
+        """
+        :param lines: lines to classify
+        :return: list of classifications
+        """
+        return self.call("POST", "/predict", {"lines": lines})["labels"]
+
+    def stats(self):
+        """
+        :return: the server's metrics
+        """
+        return self.call("GET", "/stats")
+
+
+def main():
+    """
+    Main function. (Test) Serves a model on a
+    temporary Unix socket and queries it from
+    many threads at once.
+    """
+    model = load_model(sys.argv[1] if len(sys.argv) > 1 else "./out/ensemble.oj")
+    socket_path = os.path.join(tempfile.mkdtemp(), "classify.sock")
+    server = make_server(model, socket_path=socket_path)
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    client = Client(socket_path=socket_path)
+    lines = [line[3:] for line in open("./in/test.dat")]
+    results = [None] * len(lines)
+
+    def query(i):
+        results[i] = client.predict(lines[i])
+
+    threads = [threading.Thread(target=query, args=(i,)) for i in range(len(lines))]
+
+    for t in threads:
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    print(results)
+    print(client.predict_lines(lines[:3]))
+    print(json.dumps(client.stats(), indent=2))
+
+    server.shutdown()
+    server.server_close()
+    os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import json
+import os
+import tempfile
+import time
+from multiprocessing import Pool
+
+import model_file
+from ada_model import AdaModel
+from corpus_index import deal_folds, goal_groups
+from d_model import DecisionModel
+from feature_matrix import Codebook
+from parse import parse_matrix
+
+# feature matrix and folds shared by the worker processes
+SHARED = {}
+
+
+def share(matrix, folds):
+    """
+    Gives a worker process the feature matrix
+    and the folds. Forked workers inherit them
+    without a copy.
+
+    :param matrix: feature matrix of the corpus
+    :param folds: list of (train, test) pairs of row indices
+    """
+    SHARED["matrix"] = matrix
+    SHARED["folds"] = folds
+
+
+def configurations(depths=(), rounds=()):
+    """
+    :param depths: decision tree depths
+    :param rounds: AdaBoost ensemble sizes
+    :return: list of (learner, parameter) pairs
+    """
+    return [("dt", depth) for depth in depths] + [("ada", size) for size in rounds]
+
+
+def run_fold(task):
+    """
+    Trains one configuration on one fold and
+    scores it on the fold's held-out rows.
+
+    :param task: (learner, parameter, fold number)
+    :return: (learner, parameter, fold number, accuracy,
+             training seconds, nodes, model bytes)
+    """
+    learner, parameter, fold = task
+    matrix = SHARED["matrix"]
+    train_rows, test_rows = SHARED["folds"][fold]
+    fd, path = tempfile.mkstemp(suffix=".oj")
+    os.close(fd)
+
+    try:
+        if learner == "dt":
+            model = DecisionModel(train_file=None, test_file=None, out_file=path)
+        else:
+            model = AdaModel(train_file=None, test_file=None, out_file=path)
+
+        model.data["train"] = matrix.take(train_rows)
+        model.data["test"] = matrix.take(test_rows)
+        start = time.time()
+        # the depth of a tree, or the size of an ensemble
+        model.train(parameter, save=False)
+        seconds = time.time() - start
+        model.save()
+        manifest = model_file.describe(path)
+    finally:
+        os.remove(path)
+
+    return learner, parameter, fold, manifest["accuracy"], seconds, manifest["nodes"], manifest["bytes"]
+
+
+def cross_validate(corpus, configs, k=5, workers=1, seed=0, ngrams=None):
+    """
+    Featurizes a corpus once, cuts it into k
+    stratified folds and trains every
+    configuration on every fold in a pool of
+    worker processes.
+
+    :param corpus: corpus file
+    :param configs: list of (learner, parameter) pairs, as
+                    from configurations()
+    :param k: number of folds
+    :param workers: worker processes
+    :param seed: random seed of the folds
+    :param ngrams: NgramHasher adding n-gram features, or None
+    :return: list of results per configuration, most accurate first
+    """
+    matrix = parse_matrix([corpus], Codebook(hasher=ngrams), keep_text=False, workers=workers)[0]
+    folds = deal_folds(goal_groups(matrix), k, seed)
+    tasks = [(learner, parameter, fold) for learner, parameter in configs for fold in range(k)]
+
+    if workers > 1:
+        with Pool(workers, initializer=share, initargs=(matrix, folds)) as pool:
+            outcomes = list(pool.imap_unordered(run_fold, tasks))
+    else:
+        share(matrix, folds)
+        outcomes = [run_fold(task) for task in tasks]
+
+    return summarize(outcomes, configs)
+
+
+def summarize(outcomes, configs):
+    """
+    Averages the fold results of every configuration.
+
+    :param outcomes: results of run_fold
+    :param configs: list of (learner, parameter) pairs
+    :return: list of results per configuration, most accurate first
+    """
+    results = []
+
+    for learner, parameter in configs:
+        runs = [o for o in outcomes if o[0] == learner and o[1] == parameter]
+        accuracies = [o[3] for o in runs if o[3] is not None]
+        mean = sum(accuracies) / len(accuracies) if accuracies else None
+        spread = (sum((a - mean) ** 2 for a in accuracies) / len(accuracies)) ** 0.5 if accuracies else None
+
+        results.append({
+            "learner": learner,
+            "depth" if learner == "dt" else "rounds": parameter,
+            "accuracy": mean,
+            "accuracy_std": spread,
+            "train_sec": sum(o[4] for o in runs) / len(runs),
+            "nodes": sum(o[5] for o in runs) / len(runs),
+            "bytes": sum(o[6] for o in runs) / len(runs),
+            "folds": len(runs),
+        })
+
+    results.sort(key=lambda r: -1 if r["accuracy"] is None else r["accuracy"], reverse=True)
+
+    return results
+
+
+def report(results):
+    """
+    Prints the results of a sweep.
+
+    :param results: results of cross_validate
+    """
+    for r in results:
+        print("|", r["learner"], "| depth:" if r["learner"] == "dt" else "| rounds:",
+              r.get("depth", r.get("rounds")),
+              "| accuracy: %.4f +- %.4f" % (r["accuracy"] or 0, r["accuracy_std"] or 0),
+              "| train sec: %.3f" % r["train_sec"],
+              "| nodes: %.1f" % r["nodes"],
+              "| bytes: %d" % r["bytes"])
+
+
+def write(results, path):
+    """
+    Writes the results of a sweep as JSON.
+
+    :param results: results of cross_validate
+    :param path: output file
+    """
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
@@ -1,25 +1,32 @@
+from array import array
+
+
 class WeightedSample:
     """
     This class represents a weighted sample.
-    The weights of every instance in the sample
-    form a distribution.
+    The weights of every row in a feature
+    matrix form a distribution. The weights
+    are kept in one contiguous array on the
+    matrix.
     """
 
-    def __init__(self, instances):
+    def __init__(self, matrix, weights=None):
         """
-        Initialize the sample with a list of
-        instances.
+        Initialize the sample with a feature
+        matrix. Every row starts with a weight
+        of 1, unless weights are given.
 
-        :param instances: list of instances.
+        :param matrix: feature matrix.
+        :param weights: weight of every row, to resume from
         """
-        self.data = instances
-        self.sum = 0
-
-        for instance in self.data:
-            instance.weight = 1
-            self.sum += instance.weight
+        if weights is not None and len(weights) != matrix.size():
+            raise ValueError("expected " + str(matrix.size()) + " weights, got " + str(len(weights)))
 
-        self.dist_sum = self.sum
+        self.data = matrix
+        self.data.weights = array("d", weights) if weights is not None else array("d", [1.0]) * matrix.size()
+        self.sum = sum(self.data.weights)
+        self.dist_sum = float(matrix.size())
+        self.sampler = None
 
     def normalize(self):
         """
@@ -27,26 +34,120 @@ class WeightedSample:
         distribution
         """
         z = self.dist_sum/self.sum
-        self.sum = 0
+        weights = self.data.weights
 
-        for instance in self.data:
-            instance.weight *= z
-            self.sum += instance.weight
+        weights[:] = array("d", [w * z for w in weights])
+        self.sum = sum(weights)
+        self.sampler = None
 
     def change_weight(self, i, new_weight):
         """
-        Change the weight of an instance in
+        Change the weight of a row in
         the sample
 
-        :param i: index of the instance
+        :param i: index of the row
         :param new_weight: new weight
         """
-        self.sum -= self.data[i].weight
-        self.data[i].weight = new_weight
+        weights = self.data.weights
+        self.sum -= weights[i]
+        weights[i] = new_weight
         self.sum += new_weight
+        self.sampler = None
+
+    def error(self, correct):
+        """
+        :param correct: flag per row, True where
+                        the row was classified correctly
+        :return: total weight of the misclassified rows
+        """
+        return sum([w for w, ok in zip(self.data.weights, correct) if not ok])
+
+    def reweight(self, correct, factor):
+        """
+        Scales the weight of every correctly
+        classified row.
+
+        :param correct: flag per row, True where
+                        the row was classified correctly
+        :param factor: scale factor
+        """
+        weights = self.data.weights
+
+        weights[:] = array("d", [w * factor if ok else w for w, ok in zip(weights, correct)])
+        self.sum = sum(weights)
+        self.sampler = None
+
+    def draw(self, k, rng):
+        """
+        Draws rows, with replacement, in proportion
+        to their weights. The alias table is rebuilt
+        only after the weights change.
+
+        :param k: number of rows to draw
+        :param rng: random.Random to draw with
+        :return: list of row indices
+        """
+        if self.sampler is None:
+            self.sampler = AliasSampler(self.data.weights)
+
+        return self.sampler.draw(k, rng)
 
     def size(self):
         """
         :return: Sample size
         """
-        return len(self.data)
+        return self.data.size()
+
+
+class AliasSampler:
+    """
+    This class draws indices in proportion to
+    their weights in O(1) per draw, with Vose's
+    alias method. Building the tables is O(n).
+    """
+
+    def __init__(self, weights):
+        """
+        Build the alias tables.
+
+        :param weights: weight of every index
+        """
+        n = len(weights)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights] if total else [1.0] * n
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+
+        self.prob = array("d", [1.0]) * n
+        self.alias = array("l", range(n))
+
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] += scaled[less] - 1
+
+            if scaled[more] < 1:
+                small.append(more)
+            else:
+                large.append(more)
+
+    def draw(self, k, rng):
+        """
+        :param k: number of indices to draw
+        :param rng: random.Random to draw with
+        :return: list of indices
+        """
+        n = len(self.prob)
+        prob = self.prob
+        alias = self.alias
+        random = rng.random
+        result = []
+
+        for _ in range(k):
+            i = int(random() * n)
+            result.append(i if random() < prob[i] else alias[i])
+
+        return result